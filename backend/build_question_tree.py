@@ -0,0 +1,74 @@
+"""質問ツリーのビルド
+
+回答（はい/いいえ/わからない）の全ての並びについて、通常と同じプロンプトで質問を事前に生成し、
+QUESTION_MODE=tree で使うバイナリファイルにまとめる。
+
+    python build_question_tree.py --num-questions 5 --output question_tree.bin
+"""
+import argparse
+import asyncio
+import time
+
+from services.llm_gateway import get_llm_gateway, close_llm_gateway
+from services.prompts import ANSWER_CHOICES, build_question_prompt, fallback_question
+from services.question_tree import QUESTION_TREE_PATH, node_count, write_question_tree
+
+
+async def build(num_questions: int, concurrency: int) -> list:
+    """幅優先順に全ノードの質問を生成"""
+    llm = get_llm_gateway()
+    semaphore = asyncio.Semaphore(concurrency)
+    fallbacks = 0
+
+    async def generate(questions: list, answers: list, current_num: int) -> str:
+        nonlocal fallbacks
+        prompt = build_question_prompt(questions, answers, current_num, num_questions)
+        async with semaphore:
+            try:
+                question = (await llm.generate(prompt)).strip()
+            except Exception as e:
+                print(f"生成に失敗しました（{current_num + 1}問目 {answers}）: {e}")
+                question = ""
+        # 通常の質問生成と同じく、短すぎる場合はフォールバック質問にする
+        if not question or len(question) < 10:
+            fallbacks += 1
+            question = fallback_question(current_num)
+        return question
+
+    questions = []
+    level = [([], [])]  # (これまでの質問, これまでの回答)
+    for current_num in range(num_questions):
+        started = time.perf_counter()
+        generated = await asyncio.gather(*(generate(qs, ans, current_num) for qs, ans in level))
+        questions.extend(generated)
+        print(f"{current_num + 1}問目: {len(level)}件 ({time.perf_counter() - started:.1f}秒)")
+
+        level = [
+            (qs + [question], ans + [answer])
+            for (qs, ans), question in zip(level, generated)
+            for answer in ANSWER_CHOICES
+        ]
+
+    if fallbacks:
+        print(f"フォールバック質問を使ったノード: {fallbacks}件")
+    return questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="質問ツリーをビルドする")
+    parser.add_argument("--num-questions", type=int, default=5, help="全質問数（ツリーの深さ）")
+    parser.add_argument("--output", default=QUESTION_TREE_PATH, help="出力するファイル")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に生成する数")
+    args = parser.parse_args()
+
+    print(f"{node_count(args.num_questions)}件の質問を生成します")
+    try:
+        questions = asyncio.run(build(args.num_questions, args.concurrency))
+    finally:
+        close_llm_gateway()
+    write_question_tree(args.output, args.num_questions, questions)
+    print(f"{args.output} に書き出しました")
+
+
+if __name__ == "__main__":
+    main()
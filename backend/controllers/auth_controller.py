@@ -1,4 +1,4 @@
-from fastapi import HTTPException, status, Form, Depends
+from fastapi import HTTPException, status, Form, Depends, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 
@@ -6,12 +6,37 @@ from database import get_db
 from models import UserCreate, UserResponse, Token, UserLogin
 from services.auth_service import authenticate_user, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
 from services.user_service import UserService
+from services.password_hasher import PasswordHasherBusy
+from services.principal_cache import principal_cache
+from .conditional import not_modified, set_etag, user_etag
 
 
 class AuthController:
     def __init__(self):
         self.user_service = UserService()
     
+    async def _authenticate(self, db: AsyncSession, email: str, password: str):
+        """ユーザー認証（ハッシュ処理が混雑している場合は429を返す）"""
+        try:
+            return await authenticate_user(db, email, password)
+        except PasswordHasherBusy:
+            raise HTTPException(
+                status_code=429,
+                detail="ログインが混み合っています。しばらくしてから再度お試しください",
+                headers={"Retry-After": "1"}
+            )
+    
+    async def _create_user(self, db: AsyncSession, user: UserCreate) -> UserResponse:
+        """ユーザーを作成（ハッシュ処理が混雑している場合は429を返す）"""
+        try:
+            return await self.user_service.create_user(db=db, user=user)
+        except PasswordHasherBusy:
+            raise HTTPException(
+                status_code=429,
+                detail="登録が混み合っています。しばらくしてから再度お試しください",
+                headers={"Retry-After": "1"}
+            )
+    
     async def login(
         self,
         email: str = Form(...),
@@ -19,7 +44,7 @@ class AuthController:
         db: AsyncSession = Depends(get_db)
     ) -> Token:
         """フォームデータを使用したログイン"""
-        user = await authenticate_user(db, email, password)
+        user = await self._authenticate(db, email, password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -39,7 +64,7 @@ class AuthController:
         db: AsyncSession = Depends(get_db)
     ) -> Token:
         """JSONデータを使用したログイン"""
-        user = await authenticate_user(db, user_credentials.email, user_credentials.password)
+        user = await self._authenticate(db, user_credentials.email, user_credentials.password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -68,7 +93,7 @@ class AuthController:
         
         # UserCreateオブジェクトを作成
         user_data = UserCreate(email=email, password=password, full_name=full_name)
-        return await self.user_service.create_user(db=db, user=user_data)
+        return await self._create_user(db, user_data)
     
     async def register_json(
         self,
@@ -81,8 +106,28 @@ class AuthController:
         if existing_user:
             raise HTTPException(status_code=400, detail="このメールアドレスは既に使用されています")
         
-        return await self.user_service.create_user(db=db, user=user)
+        return await self._create_user(db, user)
     
-    async def get_current_user(self, current_user):
-        """現在のユーザー情報取得"""
-        return current_user
+    async def get_current_user(self, current_user, request: Request, response: Response, db: AsyncSession):
+        """現在のユーザー情報取得（If-None-MatchがETagと一致すれば304）
+
+        認証情報のキャッシュは他のワーカーでの更新を反映していないことがあるので、
+        ETagと返す内容はこのリクエストで読んだユーザーから作る。
+        """
+        user = await self.user_service.get_user(db, user_id=current_user.id)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="認証情報が無効です",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        if user.version != current_user.version:
+            principal_cache.invalidate(user.email)
+        if not user.is_active:
+            raise HTTPException(status_code=400, detail="非アクティブなユーザーです")
+        etag = user_etag(user)
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+        set_etag(response, etag)
+        return user
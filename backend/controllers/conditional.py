@@ -0,0 +1,35 @@
+from typing import Optional
+
+from fastapi import Request, Response
+
+# 認証が必要なリソースなので共有キャッシュには置かず、毎回ETagで再検証させる
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    """バージョンなどの値から強いETagを作成"""
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+
+def user_etag(user) -> str:
+    """ユーザーのETag（IDが再利用されても重ならないように作成日時も含める）"""
+    created = int(user.created_at.timestamp()) if user.created_at is not None else 0
+    return make_etag("u", user.id, created, user.version)
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """If-None-MatchがETagと一致すれば304のレスポンスを返す（一致しなければNone）"""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return None
+    # If-None-Matchは弱い比較なので W/ は無視する
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    if "*" in tags or etag in tags:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+    return None
+
+
+def set_etag(response: Response, etag: str):
+    """レスポンスにETagを付ける"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
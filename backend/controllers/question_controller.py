@@ -1,23 +1,75 @@
-from fastapi import HTTPException, Depends
-from sqlalchemy.ext.asyncio import AsyncSession
+import json
+import math
+from typing import Optional
 
-from database import get_db
-from models import QuestionRequest, QuestionResponse, AnswerRequest, AnswerResponse, ProposalRequest, ProposalResponse, User
-from services.question_service import QuestionService
-from services.auth_service import get_current_active_user
+from fastapi import HTTPException, Depends, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from models import (
+    QuestionRequest, QuestionResponse, AnswerRequest, AnswerResponse,
+    ProposalRequest, ProposalResponse, ProposalJobResponse, User
+)
+from services.question_service import QuestionService, prefetch_metrics
+from services.session_store import QuizSession, SessionConflict, create_session_store
+from services.llm_gateway import get_llm_gateway
+from services.question_pool import get_question_pool
+from services.question_tree import get_question_tree
+from services.proposal_cache import get_proposal_cache
+from services.transcript_service import transcript_writer
+from services.password_hasher import password_hasher
+from services.principal_cache import principal_cache
+from services.admission import AdmissionController, AdmissionRejected
+from services.job_queue import Job, JobQueue, JobQueueFull, PROPOSAL_JOB_MAX_WAIT_SECONDS
+from services.usage_service import QuotaLimiter, usage_meter
+from services.auth_service import get_current_active_user, get_principal
+from .conditional import make_etag, not_modified, set_etag
+
+
+# 回答の保存が他のワーカーの更新と競合したときに読み直す回数
+SAVE_ANSWER_ATTEMPTS = 3
 
 
 class QuestionController:
     def __init__(self):
-        self.question_service = QuestionService()
-        # セッション管理用の辞書（実際の運用ではRedisなどを使用することを推奨）
-        self.genai_sessions = {}
+        # LLMを呼び出すエンドポイントの同時実行数と待ち行列を制限する（先読みも同じ枠を使う）
+        self.admission = AdmissionController()
+        self.question_service = QuestionService(admission=self.admission)
+        # セッション管理（SESSION_BACKENDでメモリかSQLiteを選択、破棄したセッションは履歴に残す）
+        self.sessions = create_session_store(
+            on_evict=self.question_service.discard_prefetch,
+            on_expire=transcript_writer.record
+        )
+        # ユーザーごとの生成回数の上限（消費はサービスが実際にLLMを呼び出したときに行う）
+        self.question_quota = self.question_service.quotas["question"]
+        self.proposal_quota = self.question_service.quotas["proposal"]
+        # 提案生成のジョブ（接続を保持せずに結果をポーリングで受け取る）
+        self.proposal_jobs = JobQueue()
+    
+    async def get_session(self, user_id: int) -> QuizSession:
+        """ユーザー固有のセッションを取得"""
+        return await self.sessions.load(user_id)
     
-    def get_genai_service(self, user_id: int) -> QuestionService:
-        """ユーザー固有のQuestionServiceインスタンスを取得"""
-        if user_id not in self.genai_sessions:
-            self.genai_sessions[user_id] = QuestionService()
-        return self.genai_sessions[user_id]
+    def _check_quota(self, quota: QuotaLimiter, user_id: int):
+        """ユーザーの生成回数の上限を確認（超えていれば429を返す。ここでは消費しない）"""
+        retry_after = quota.retry_after(user_id)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="生成回数の上限に達しました。しばらくしてから再度お試しください",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
+    
+    async def _admit(self):
+        """実行枠を取得（混雑時は429を返す）"""
+        try:
+            await self.admission.acquire()
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=429,
+                detail="リクエストが混み合っています。しばらくしてから再度お試しください",
+                headers={"Retry-After": str(e.retry_after)}
+            )
     
     async def get_question(
         self,
@@ -25,12 +77,17 @@ class QuestionController:
         current_user: User = Depends(get_current_active_user)
     ) -> QuestionResponse:
         """新しい質問を取得"""
+        self._check_quota(self.question_quota, current_user.id)
+        await self._admit()
         try:
-            genai_service = self.get_genai_service(current_user.id)
-            question = genai_service.get_question(
+            session = await self.get_session(current_user.id)
+            question = await self.question_service.get_question(
+                session,
                 current_num=request.current_num,
-                num_questions=request.num_questions
+                num_questions=request.num_questions,
+                mode=request.mode
             )
+            await self.sessions.save(session)
             return QuestionResponse(
                 question=question,
                 current_num=request.current_num + 1,
@@ -38,8 +95,39 @@ class QuestionController:
             )
         except ValueError as e:
             raise HTTPException(status_code=400, detail=str(e))
+        except SessionConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"質問の生成に失敗しました: {str(e)}")
+        finally:
+            self.admission.release()
+    
+    async def stream_question(
+        self,
+        request: QuestionRequest,
+        current_user: User = Depends(get_current_active_user)
+    ) -> StreamingResponse:
+        """新しい質問をSSEでストリーミング"""
+        session = await self.get_session(current_user.id)
+        try:
+            chunks = self.question_service.stream_question(
+                session,
+                current_num=request.current_num,
+                num_questions=request.num_questions,
+                mode=request.mode
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        def done():
+            return QuestionResponse(
+                question=session.questions[-1],
+                current_num=request.current_num + 1,
+                total_questions=request.num_questions
+            )
+        self._check_quota(self.question_quota, current_user.id)
+        await self._admit()
+        return self._sse_response(session, chunks, done, "質問の生成に失敗しました")
     
     async def save_answer(
         self,
@@ -48,17 +136,28 @@ class QuestionController:
     ) -> AnswerResponse:
         """回答を保存"""
         try:
-            genai_service = self.get_genai_service(current_user.id)
-            genai_service.save_answer(
-                answer=request.answer,
-                current_num=request.current_num
-            )
+            for attempt in range(SAVE_ANSWER_ATTEMPTS):
+                session = await self.get_session(current_user.id)
+                self.question_service.save_answer(
+                    session,
+                    answer=request.answer,
+                    current_num=request.current_num
+                )
+                try:
+                    await self.sessions.save(session)
+                    break
+                except SessionConflict:
+                    # 他のワーカーの更新を読み直し、回答の順序を確認し直す
+                    if attempt == SAVE_ANSWER_ATTEMPTS - 1:
+                        raise
             return AnswerResponse(
                 message="回答が正常に保存されました",
                 current_num=request.current_num + 1
             )
         except ValueError as e:
             raise HTTPException(status_code=400, detail=str(e))
+        except SessionConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"回答の保存に失敗しました: {str(e)}")
     
@@ -68,23 +167,248 @@ class QuestionController:
         current_user: User = Depends(get_current_active_user)
     ) -> ProposalResponse:
         """自分磨きの提案を取得"""
+        self._check_quota(self.proposal_quota, current_user.id)
+        await self._admit()
         try:
-            genai_service = self.get_genai_service(current_user.id)
-            proposal = genai_service.get_proposal()
+            session = await self.get_session(current_user.id)
+            proposal = await self.question_service.get_proposal(session)
+            await self.sessions.save(session)
             return ProposalResponse(proposal=proposal)
         except ValueError as e:
             raise HTTPException(status_code=400, detail=str(e))
+        except SessionConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"提案の生成に失敗しました: {str(e)}")
+        finally:
+            self.admission.release()
+    
+    async def submit_proposal_job(
+        self,
+        request: ProposalRequest,
+        current_user: User = Depends(get_current_active_user)
+    ) -> ProposalJobResponse:
+        """提案生成のジョブを登録（未完了のジョブがあればそのジョブを返す）"""
+        job = self.proposal_jobs.active(current_user.id)
+        if job is None:
+            session = await self.get_session(current_user.id)
+            try:
+                self.question_service.check_proposal(session)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            self._check_quota(self.proposal_quota, current_user.id)
+
+            user_id = current_user.id
+
+            async def run():
+                session = await self.get_session(user_id)
+                proposal = await self.question_service.get_proposal(session)
+                await self.sessions.save(session)
+                return ProposalResponse(proposal=proposal)
+
+            try:
+                job = self.proposal_jobs.submit(user_id, run)
+            except JobQueueFull:
+                raise HTTPException(
+                    status_code=429,
+                    detail="リクエストが混み合っています。しばらくしてから再度お試しください",
+                    headers={"Retry-After": "5"}
+                )
+        return self._job_response(job)
+    
+    async def get_proposal_job(
+        self,
+        job_id: str,
+        wait: float = 0,
+        current_user: User = Depends(get_current_active_user)
+    ) -> ProposalJobResponse:
+        """提案生成のジョブの状態を取得（waitを指定すると完了まで最大wait秒待つ）"""
+        job = self.proposal_jobs.get(job_id)
+        if job is None and self.proposal_jobs.is_remote(job_id):
+            # ジョブはプロセスごとに保持しているので、登録したのと別のワーカーでは参照できない
+            raise HTTPException(
+                status_code=421,
+                detail="このジョブは別のワーカープロセスで登録されたため参照できません（同じワーカーへのスティッキーな振り分けが必要です）"
+            )
+        if job is None or job.user_id != current_user.id:
+            raise HTTPException(status_code=404, detail="ジョブが見つからないか、結果の保持期間が過ぎています")
+        job = await self.proposal_jobs.wait(job, min(max(wait, 0), PROPOSAL_JOB_MAX_WAIT_SECONDS))
+        return self._job_response(job)
+    
+    @staticmethod
+    def _job_response(job: Job) -> ProposalJobResponse:
+        detail = None
+        if job.status == Job.FAILED:
+            if isinstance(job.error, (ValueError, SessionConflict)):
+                detail = str(job.error)
+            else:
+                detail = f"提案の生成に失敗しました: {str(job.error)}"
+        return ProposalJobResponse(job_id=job.id, status=job.status, result=job.result, detail=detail)
+    
+    async def stream_proposal(
+        self,
+        request: ProposalRequest,
+        current_user: User = Depends(get_current_active_user)
+    ) -> StreamingResponse:
+        """自分磨きの提案をSSEでストリーミング"""
+        session = await self.get_session(current_user.id)
+        try:
+            chunks = self.question_service.stream_proposal(session)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        def done():
+            return ProposalResponse(proposal=session.proposal)
+        self._check_quota(self.proposal_quota, current_user.id)
+        await self._admit()
+        return self._sse_response(session, chunks, done, "提案の生成に失敗しました")
+    
+    def _sse_response(self, session: QuizSession, chunks, done, error_message: str) -> StreamingResponse:
+        """チャンクを`chunk`イベント、確定した結果を`done`イベントとして送るSSEレスポンスを作成
+
+        セッションは生成が終わってから保存する。実行枠は送信が終わった後（切断時も含む）に返却する。
+        """
+        async def events():
+            try:
+                async for chunk in chunks:
+                    yield self._sse_event("chunk", {"text": chunk})
+                await self.sessions.save(session)
+                yield self._sse_event("done", done().model_dump())
+            except Exception as e:
+                yield self._sse_event("error", {"detail": f"{error_message}: {str(e)}"})
+
+        # 同期関数はスレッドプールで実行されるので、イベントループ上で返却するようにasyncで包む
+        async def release():
+            self.admission.release()
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            background=BackgroundTask(release)
+        )
+    
+    @staticmethod
+    def _sse_event(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    async def quiz_websocket(self, websocket: WebSocket, token: Optional[str] = None):
+        """WebSocketでクイズを進行（認証は接続時の1回だけ）
+
+        クライアントからのメッセージ:
+        - {"type": "start", "num_questions": 5, "mode": "adaptive"} セッションをリセットして最初の質問を返す
+        - {"type": "answer", "answer": "はい"} 回答を保存し、次の質問（最後なら提案）を返す
+        - {"type": "next"} 回答待ちの質問を返す（次の質問の生成が失敗したときの再試行用）
+        - {"type": "proposal"} 提案を返す
+
+        エラーは {"type": "error", "status": 429, "detail": "...", "retry_after": 5} の形で返す（retry_afterは429のときだけ）
+        """
+        current_user = await self._authenticate_websocket(websocket, token)
+        if current_user is None:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="認証情報が無効です")
+            return
+        await websocket.accept()
+
+        num_questions = 5
+        mode = "adaptive"
+        try:
+            while True:
+                text = await websocket.receive_text()
+                try:
+                    message = json.loads(text)
+                    kind = message.get("type")
+                    if kind == "start":
+                        request = QuestionRequest(
+                            current_num=0,
+                            num_questions=message.get("num_questions", num_questions),
+                            mode=message.get("mode", mode)
+                        )
+                        num_questions, mode = request.num_questions, request.mode
+                        await self.reset_session(current_user)
+                        reply = await self._ws_question(request, current_user)
+                    elif kind == "answer":
+                        session = await self.get_session(current_user.id)
+                        current_num = int(message.get("current_num", len(session.answers)))
+                        await self.save_answer(
+                            AnswerRequest(answer=message.get("answer"), current_num=current_num),
+                            current_user
+                        )
+                        if current_num + 1 < num_questions:
+                            request = QuestionRequest(current_num=current_num + 1, num_questions=num_questions, mode=mode)
+                            reply = await self._ws_question(request, current_user)
+                        else:
+                            reply = await self._ws_proposal(current_user)
+                    elif kind == "next":
+                        reply = await self._ws_next(num_questions, mode, current_user)
+                    elif kind == "proposal":
+                        reply = await self._ws_proposal(current_user)
+                    else:
+                        reply = {"type": "error", "status": 400, "detail": "不明なメッセージです"}
+                except HTTPException as e:
+                    reply = {"type": "error", "status": e.status_code, "detail": e.detail}
+                    if e.headers and "Retry-After" in e.headers:
+                        reply["retry_after"] = int(e.headers["Retry-After"])
+                except (ValueError, TypeError, AttributeError) as e:
+                    reply = {"type": "error", "status": 400, "detail": f"メッセージの形式が正しくありません: {str(e)}"}
+                await websocket.send_text(json.dumps(reply, ensure_ascii=False))
+        except WebSocketDisconnect:
+            pass
+
+    async def _authenticate_websocket(self, websocket: WebSocket, token: Optional[str]) -> Optional[User]:
+        """クエリのtokenかAuthorizationヘッダーからアクティブなユーザーを取得"""
+        if token is None:
+            scheme, _, credentials = websocket.headers.get("authorization", "").partition(" ")
+            if scheme.lower() == "bearer":
+                token = credentials
+        if not token:
+            return None
+        user = await get_principal(token)
+        if user is None or not user.is_active:
+            return None
+        return user
+
+    async def _ws_question(self, request: QuestionRequest, current_user: User) -> dict:
+        response = await self.get_question(request, current_user)
+        return {"type": "question", **response.model_dump()}
+
+    async def _ws_next(self, num_questions: int, mode: str, current_user: User) -> dict:
+        """回答待ちの質問を返す（生成済みならそのまま、未生成なら生成し、全問回答済みなら提案）"""
+        session = await self.get_session(current_user.id)
+        current_num = len(session.answers)
+        if current_num >= num_questions:
+            return await self._ws_proposal(current_user)
+        if current_num < len(session.questions):
+            return {
+                "type": "question",
+                **QuestionResponse(
+                    question=session.questions[current_num],
+                    current_num=current_num + 1,
+                    total_questions=num_questions
+                ).model_dump()
+            }
+        request = QuestionRequest(current_num=current_num, num_questions=num_questions, mode=mode)
+        return await self._ws_question(request, current_user)
+
+    async def _ws_proposal(self, current_user: User) -> dict:
+        response = await self.get_proposal(ProposalRequest(), current_user)
+        return {"type": "proposal", **response.model_dump()}
     
     async def get_session_data(
         self,
+        request: Request,
+        response: Response,
         current_user: User = Depends(get_current_active_user)
     ) -> dict:
-        """現在のセッションデータを取得"""
+        """現在のセッションデータを取得（If-None-MatchがETagと一致すれば304）"""
         try:
-            genai_service = self.get_genai_service(current_user.id)
-            return genai_service.get_session_data()
+            session = await self.get_session(current_user.id)
+            # 保存のたびに増えるバージョンと、作り直しを区別する作成時刻から作る
+            etag = make_etag("s", session.user_id, int(session.created_at * 1000), session.version)
+            cached = not_modified(request, etag)
+            if cached is not None:
+                return cached
+            set_etag(response, etag)
+            return self.question_service.get_session_data(session)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"セッションデータの取得に失敗しました: {str(e)}")
     
@@ -94,8 +418,44 @@ class QuestionController:
     ) -> dict:
         """セッションをリセット"""
         try:
-            genai_service = self.get_genai_service(current_user.id)
-            genai_service.reset_session()
+            session = await self.get_session(current_user.id)
+            transcript_writer.record(session, "reset")
+            self.question_service.reset_session(session)
+            await self.sessions.save(session)
             return {"message": "セッションが正常にリセットされました"}
+        except SessionConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"セッションのリセットに失敗しました: {str(e)}")
+    
+    async def get_stats(
+        self,
+        current_user: User = Depends(get_current_active_user)
+    ) -> dict:
+        """LLM呼び出しの統計を取得（運用監視用）"""
+        pool = get_question_pool()
+        tree = get_question_tree()
+        proposal_cache = get_proposal_cache()
+        return {
+            "llm": get_llm_gateway().stats(),
+            "admission": self.admission.stats(),
+            "quota": {
+                "question": self.question_quota.stats(),
+                "proposal": self.proposal_quota.stats()
+            },
+            "usage": usage_meter.stats(),
+            "transcripts": transcript_writer.stats(),
+            "sessions": await self.sessions.stats(),
+            "proposal_jobs": self.proposal_jobs.stats(),
+            "password_hasher": password_hasher.stats(),
+            "principal_cache": principal_cache.stats(),
+            "prefetch": prefetch_metrics.snapshot(),
+            "question_pool": pool.stats() if pool is not None else None,
+            "question_tree": tree.stats() if tree is not None else None,
+            "proposal_cache": proposal_cache.stats() if proposal_cache is not None else None
+        }
+    
+    def close(self):
+        """ジョブのワーカーを止めてセッションストアを閉じる"""
+        self.proposal_jobs.close()
+        self.sessions.close()
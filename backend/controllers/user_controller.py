@@ -1,11 +1,21 @@
-from fastapi import HTTPException, Depends
+import json
+import os
+
+from fastapi import HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 
 from database import get_db
-from models import UserUpdate, UserResponse, User
-from services.user_service import UserService
+from models import UserUpdate, UserResponse, User, BulkRowError, BulkUserResult
+from services.user_service import UserService, USER_PAGE_MAX_LIMIT
 from services.auth_service import get_current_active_user
+from services.password_hasher import PasswordHasherBusy
+from .conditional import not_modified, set_etag, user_etag
+
+# 一括処理で1回に受け付ける最大件数（環境変数で上書き可能）
+USER_BULK_MAX_ROWS = int(os.getenv("USER_BULK_MAX_ROWS", "10000"))
 
 
 class UserController:
@@ -14,25 +24,50 @@ class UserController:
     
     async def get_users(
         self,
-        skip: int = 0,
+        response: Response,
+        after: Optional[int] = None,
         limit: int = 100,
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
     ) -> List[UserResponse]:
-        """ユーザー一覧を取得（管理者用）"""
-        users = await self.user_service.get_users(db, skip=skip, limit=limit)
+        """ユーザー一覧を取得（管理者用）
+        
+        続きがある場合は、次のページのafterに渡すIDをX-Next-Cursorヘッダーで返す。
+        """
+        limit = max(1, min(limit, USER_PAGE_MAX_LIMIT))
+        users = await self.user_service.get_users(db, after=after, limit=limit)
+        if len(users) == limit:
+            response.headers["X-Next-Cursor"] = str(users[-1].id)
         return users
     
+    async def export_users(
+        self,
+        current_user: User = Depends(get_current_active_user)
+    ) -> StreamingResponse:
+        """全ユーザーをNDJSONでエクスポート（管理者用）"""
+        return StreamingResponse(
+            self.user_service.export_users(),
+            media_type="application/x-ndjson",
+            headers={"Content-Disposition": 'attachment; filename="users.ndjson"'}
+        )
+    
     async def get_user(
         self,
         user_id: int,
+        request: Request,
+        response: Response,
         db: AsyncSession = Depends(get_db),
         current_user: User = Depends(get_current_active_user)
     ) -> UserResponse:
-        """特定のユーザーを取得"""
+        """特定のユーザーを取得（If-None-MatchがETagと一致すれば304）"""
         user = await self.user_service.get_user(db, user_id=user_id)
         if user is None:
             raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
+        etag = user_etag(user)
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+        set_etag(response, etag)
         return user
     
     async def update_user(
@@ -43,7 +78,14 @@ class UserController:
         current_user: User = Depends(get_current_active_user)
     ) -> UserResponse:
         """ユーザーを更新"""
-        updated_user = await self.user_service.update_user(db, user_id=user_id, user=user)
+        try:
+            updated_user = await self.user_service.update_user(db, user_id=user_id, user_update=user)
+        except PasswordHasherBusy:
+            raise HTTPException(
+                status_code=429,
+                detail="リクエストが混み合っています。しばらくしてから再度お試しください",
+                headers={"Retry-After": "1"}
+            )
         if updated_user is None:
             raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
         return updated_user
@@ -59,3 +101,74 @@ class UserController:
         if not success:
             raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
         return {"message": "ユーザーが正常に削除されました"}
+    
+    async def import_users(
+        self,
+        request: Request,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_active_user)
+    ) -> BulkUserResult:
+        """ユーザーを一括作成（管理者用）"""
+        rows, errors = await self._read_bulk_rows(request)
+        return await self._run_bulk(db, self.user_service.import_users(db, rows, errors))
+    
+    async def update_users(
+        self,
+        request: Request,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_active_user)
+    ) -> BulkUserResult:
+        """ユーザーを一括更新（管理者用）"""
+        rows, errors = await self._read_bulk_rows(request)
+        return await self._run_bulk(db, self.user_service.update_users(db, rows, errors))
+    
+    async def deactivate_users(
+        self,
+        request: Request,
+        db: AsyncSession = Depends(get_db),
+        current_user: User = Depends(get_current_active_user)
+    ) -> BulkUserResult:
+        """ユーザーを一括で非アクティブにする（管理者用）"""
+        rows, errors = await self._read_bulk_rows(request)
+        return await self._run_bulk(db, self.user_service.deactivate_users(db, rows, errors))
+    
+    async def _read_bulk_rows(self, request: Request) -> tuple:
+        """JSON配列かNDJSONの本文を (入力の位置, 値) の並びにする（JSONとして読めない行はエラーとして返す）"""
+        body = await request.body()
+        rows = []
+        errors = []
+        if "ndjson" in request.headers.get("content-type", ""):
+            lines = [line for line in body.splitlines() if line.strip()]
+            for index, line in enumerate(lines):
+                try:
+                    rows.append((index, json.loads(line)))
+                except ValueError:
+                    errors.append(BulkRowError(index=index, detail="JSONとして読み込めません"))
+        else:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="JSONとして読み込めません")
+            if not isinstance(data, list):
+                raise HTTPException(status_code=400, detail="配列かNDJSONで指定してください")
+            rows = list(enumerate(data))
+        
+        if len(rows) + len(errors) > USER_BULK_MAX_ROWS:
+            raise HTTPException(status_code=413, detail=f"一度に処理できるのは{USER_BULK_MAX_ROWS}件までです")
+        return rows, errors
+    
+    async def _run_bulk(self, db: AsyncSession, operation) -> BulkUserResult:
+        """一括処理を実行（失敗した場合は全体を取り消す）"""
+        try:
+            return await operation
+        except PasswordHasherBusy:
+            await db.rollback()
+            raise HTTPException(
+                status_code=429,
+                detail="リクエストが混み合っています。しばらくしてから再度お試しください",
+                headers={"Retry-After": "1"}
+            )
+        except IntegrityError:
+            # 検証後に他のリクエストが同じメールアドレスを登録した場合など
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="他の更新と競合しました。もう一度お試しください")
@@ -1,19 +1,71 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, event, inspect, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from datetime import datetime
 import os
 
-# データベースURL
-DATABASE_URL = "sqlite+aiosqlite:///./hackathon.db"
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes")
+
+
+# 接続プロファイル（development: SQLをログに出力 / production: 出力せず、接続の死活確認を行う）
+DATABASE_PROFILE = os.getenv("DATABASE_PROFILE", "development")
+_production = DATABASE_PROFILE == "production"
+
+# データベースURLとエンジンの設定（環境変数で上書き可能）
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./hackathon.db")
+DATABASE_ECHO = _env_bool("DATABASE_ECHO", not _production)
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+DATABASE_POOL_TIMEOUT_SECONDS = float(os.getenv("DATABASE_POOL_TIMEOUT_SECONDS", "30"))
+DATABASE_POOL_PRE_PING = _env_bool("DATABASE_POOL_PRE_PING", _production)
+
+# SQLiteの場合に接続ごとに設定するPRAGMA
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+SQLITE_MMAP_SIZE_BYTES = int(os.getenv("SQLITE_MMAP_SIZE_BYTES", "268435456"))
+
+_url = make_url(DATABASE_URL)
+_sqlite = _url.get_backend_name() == "sqlite"
+# インメモリのSQLiteは1接続を使い回すプールになるため、プールの大きさは指定しない
+_sqlite_memory = _sqlite and _url.database in (None, "", ":memory:")
+
+_engine_options = {"echo": DATABASE_ECHO, "pool_pre_ping": DATABASE_POOL_PRE_PING}
+if _sqlite:
+    _engine_options["connect_args"] = {"check_same_thread": False}
+if not _sqlite_memory:
+    # ファイルのSQLiteは既定では接続を使い回さない（NullPool）ので、明示的にプールを使う
+    _engine_options.update(
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=DATABASE_POOL_SIZE,
+        max_overflow=DATABASE_MAX_OVERFLOW,
+        pool_timeout=DATABASE_POOL_TIMEOUT_SECONDS,
+    )
 
 # 非同期エンジンの作成
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,  # SQLクエリをログに出力（開発時のみ）
-    connect_args={"check_same_thread": False}
-)
+engine = create_async_engine(DATABASE_URL, **_engine_options)
+
+SQLITE_PRAGMAS = {
+    "journal_mode": SQLITE_JOURNAL_MODE,
+    "synchronous": SQLITE_SYNCHRONOUS,
+    "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+    "cache_size": -SQLITE_CACHE_SIZE_KB,  # 負の値はKiB単位
+    "mmap_size": SQLITE_MMAP_SIZE_BYTES,
+}
+
+if _sqlite:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
 
 # セッションクラスの作成
 AsyncSessionLocal = sessionmaker(
@@ -35,3 +87,32 @@ async def get_db():
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+
+def _add_missing_columns(conn):
+    """create_allは既存のテーブルに列を追加しないので、後から追加した列をここで追加する"""
+    columns = {column["name"] for column in inspect(conn).get_columns("users")}
+    if "version" not in columns:
+        conn.execute(text("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+
+async def describe_engine() -> dict:
+    """実際に有効になっているエンジンの設定を取得（起動時の確認用）"""
+    report = {
+        "profile": DATABASE_PROFILE,
+        "url": _url.render_as_string(hide_password=True),
+        "echo": DATABASE_ECHO,
+        "pool": engine.pool.__class__.__name__,
+        "pool_pre_ping": DATABASE_POOL_PRE_PING,
+    }
+    if not _sqlite_memory:
+        report.update(
+            pool_size=DATABASE_POOL_SIZE,
+            max_overflow=DATABASE_MAX_OVERFLOW,
+            pool_timeout_seconds=DATABASE_POOL_TIMEOUT_SECONDS,
+        )
+    if _sqlite:
+        # 設定した値ではなく、接続から読み戻した値を報告する
+        async with engine.connect() as conn:
+            for name in SQLITE_PRAGMAS:
+                report[name] = (await conn.execute(text(f"PRAGMA {name}"))).scalar()
+    return report
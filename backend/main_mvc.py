@@ -1,10 +1,23 @@
+import asyncio
+import logging
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
-from database import init_db
+from database import engine, init_db, describe_engine
 from models import HealthResponse
 from routes import auth_router, user_router, question_router
+from routes.question_routes import question_controller
+from services.llm_gateway import close_llm_gateway
+from services.question_pool import get_question_pool, close_question_pool
+from services.question_tree import close_question_tree
+from services.usage_service import usage_meter
+from services.transcript_service import transcript_writer
+from services.password_hasher import password_hasher
+
+# 起動時の報告はuvicornのログに出力する
+logger = logging.getLogger("uvicorn.error")
 
 app = FastAPI(
     title="Hackathon 2025 API",
@@ -19,12 +32,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],  # ユーザー一覧の次のページのカーソルと、条件付きGETのETag
 )
 
 # アプリケーション起動時にデータベースを初期化
 @app.on_event("startup")
 async def startup_event():
     await init_db()
+    # 実際に有効なデータベースの設定を出力
+    logger.info("データベースの設定: %s", await describe_engine())
+    # 最初の質問の事前生成を開始
+    pool = get_question_pool()
+    if pool is not None:
+        pool.start()
+    # LLM利用量の定期的な書き出しを開始
+    app.state.usage_flusher = asyncio.create_task(usage_meter.run())
+    # 終了したクイズの履歴の書き出しを開始
+    app.state.transcript_flusher = asyncio.create_task(transcript_writer.run())
+    # パスワードのハッシュ化を行うプロセスを起動（最初のログインで待たせないため）
+    password_hasher.start()
+
+async def _stop(task: asyncio.Task):
+    """バックグラウンドのタスクをキャンセルし、終了するまで待つ"""
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+# アプリケーション終了時にLLMクライアントの接続を解放
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 書き出し中にキャンセルした分は戻されるので、ループの終了を待ってから残りを書き出す
+    await _stop(app.state.usage_flusher)
+    await usage_meter.flush()
+    await _stop(app.state.transcript_flusher)
+    question_controller.close()
+    await transcript_writer.flush()
+    close_question_pool()
+    close_question_tree()
+    close_llm_gateway()
+    password_hasher.close()
+    await engine.dispose()
 
 # ルートエンドポイント
 @app.get("/")
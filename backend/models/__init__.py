@@ -1,17 +1,19 @@
-from .database_models import User
+from .database_models import User, LLMUsage, QuizSessionRecord, QuizTurn, QuizProposal
 from .schemas import (
     UserCreate, UserUpdate, UserResponse,
+    UserBulkUpdate, UserBulkDeactivate, BulkRowError, BulkUserResult,
     HealthResponse, Token, UserLogin,
     QuestionRequest, QuestionResponse, AnswerRequest, AnswerResponse, 
-    ProposalRequest, ProposalResponse
+    ProposalRequest, ProposalResponse, ProposalJobResponse
 )
 
 __all__ = [
     # Database models
-    'User',
+    'User', 'LLMUsage', 'QuizSessionRecord', 'QuizTurn', 'QuizProposal',
     # Schemas
     'UserCreate', 'UserUpdate', 'UserResponse',
+    'UserBulkUpdate', 'UserBulkDeactivate', 'BulkRowError', 'BulkUserResult',
     'HealthResponse', 'Token', 'UserLogin',
     'QuestionRequest', 'QuestionResponse', 'AnswerRequest', 'AnswerResponse',
-    'ProposalRequest', 'ProposalResponse'
+    'ProposalRequest', 'ProposalResponse', 'ProposalJobResponse'
 ]
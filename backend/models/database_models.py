@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, ForeignKey
+from sqlalchemy.sql import func, literal_column
 from database import Base
 
 class User(Base):
@@ -11,3 +11,44 @@ class User(Base):
     full_name = Column(String(100), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     is_active = Column(Boolean, default=True)
+    # 更新のたびに1つ増える（ETag用。一括更新を含むすべてのUPDATEでデータベース側で増やす）
+    version = Column(Integer, nullable=False, default=0, server_default="0", onupdate=literal_column("version + 1"))
+
+class LLMUsage(Base):
+    __tablename__ = "llm_usage"
+    
+    user_id = Column(Integer, primary_key=True)
+    kind = Column(String(20), primary_key=True)  # "question" または "proposal"
+    calls = Column(Integer, nullable=False, default=0)
+    prompt_chars = Column(Integer, nullable=False, default=0)
+    response_chars = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    response_tokens = Column(Integer, nullable=False, default=0)
+    latency_ms = Column(Float, nullable=False, default=0.0)  # 合計
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class QuizSessionRecord(Base):
+    __tablename__ = "quiz_session_records"
+    
+    id = Column(String(32), primary_key=True)  # uuid4().hex（一括書き込みのためアプリ側で採番）
+    user_id = Column(Integer, nullable=False, index=True)
+    reason = Column(String(20), nullable=False)  # "reset"、"expired" または "evicted"
+    num_turns = Column(Integer, nullable=False, default=0)
+    ended_at = Column(DateTime(timezone=True), nullable=False)
+
+class QuizTurn(Base):
+    __tablename__ = "quiz_turns"
+    
+    session_id = Column(String(32), ForeignKey("quiz_session_records.id"), primary_key=True)
+    turn = Column(Integer, primary_key=True)
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=True)  # 未回答ならNULL
+
+class QuizProposal(Base):
+    __tablename__ = "quiz_proposals"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String(32), ForeignKey("quiz_session_records.id"), nullable=False, index=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    proposal = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
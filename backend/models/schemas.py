@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 # User スキーマ
@@ -16,6 +16,21 @@ class UserUpdate(BaseModel):
     password: Optional[str] = None
     is_active: Optional[bool] = None
 
+class UserBulkUpdate(UserUpdate):
+    id: int
+
+class UserBulkDeactivate(BaseModel):
+    id: int
+
+class BulkRowError(BaseModel):
+    index: int  # 入力の何件目か（0始まり）
+    detail: str
+
+class BulkUserResult(BaseModel):
+    succeeded: int
+    failed: int
+    errors: List[BulkRowError]
+
 class UserResponse(UserBase):
     id: int
     created_at: datetime
@@ -45,6 +60,7 @@ class HealthResponse(BaseModel):
 class QuestionRequest(BaseModel):
     current_num: int = 0
     num_questions: int = 5
+    mode: Literal["adaptive", "batch"] = "adaptive"  # batch: 全質問を最初に1回で生成
 
 class QuestionResponse(BaseModel):
     question: str
@@ -64,3 +80,9 @@ class ProposalRequest(BaseModel):
 
 class ProposalResponse(BaseModel):
     proposal: str
+
+class ProposalJobResponse(BaseModel):
+    job_id: str
+    status: str  # queued / running / done / failed
+    result: Optional[ProposalResponse] = None
+    detail: Optional[str] = None
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, Form
+from fastapi import APIRouter, Depends, Form, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import get_db
@@ -40,5 +40,10 @@ async def register_json(user: UserCreate, db: AsyncSession = Depends(get_db)):
 
 # 現在のユーザー情報取得（認証必要）
 @auth_router.get("/me", response_model=UserResponse)
-async def read_users_me(current_user: User = Depends(get_current_active_user)):
-    return await auth_controller.get_current_user(current_user)
+async def read_users_me(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    return await auth_controller.get_current_user(current_user, request=request, response=response, db=db)
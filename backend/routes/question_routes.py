@@ -1,6 +1,11 @@
-from fastapi import APIRouter, Depends
+from typing import Optional
 
-from models import QuestionRequest, QuestionResponse, AnswerRequest, AnswerResponse, ProposalRequest, ProposalResponse, User
+from fastapi import APIRouter, Depends, Request, Response, WebSocket
+
+from models import (
+    QuestionRequest, QuestionResponse, AnswerRequest, AnswerResponse,
+    ProposalRequest, ProposalResponse, ProposalJobResponse, User
+)
 from controllers.question_controller import QuestionController
 from services.auth_service import get_current_active_user
 
@@ -15,6 +20,14 @@ async def get_question(
     """新しい質問を取得"""
     return await question_controller.get_question(request=request, current_user=current_user)
 
+@question_router.post("/stream")
+async def stream_question(
+    request: QuestionRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """新しい質問をSSEでストリーミング"""
+    return await question_controller.stream_question(request=request, current_user=current_user)
+
 @question_router.post("/answer", response_model=AnswerResponse)
 async def save_answer(
     request: AnswerRequest,
@@ -31,12 +44,44 @@ async def get_proposal(
     """自分磨きの提案を取得"""
     return await question_controller.get_proposal(request=request, current_user=current_user)
 
+@question_router.post("/proposal/jobs", response_model=ProposalJobResponse, status_code=202)
+async def submit_proposal_job(
+    request: ProposalRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """自分磨きの提案の生成ジョブを登録"""
+    return await question_controller.submit_proposal_job(request=request, current_user=current_user)
+
+@question_router.get("/proposal/jobs/{job_id}", response_model=ProposalJobResponse)
+async def get_proposal_job(
+    job_id: str,
+    wait: float = 0,
+    current_user: User = Depends(get_current_active_user)
+):
+    """提案の生成ジョブの状態を取得（waitで完了まで待つ秒数を指定）"""
+    return await question_controller.get_proposal_job(job_id=job_id, wait=wait, current_user=current_user)
+
+@question_router.post("/proposal/stream")
+async def stream_proposal(
+    request: ProposalRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """自分磨きの提案をSSEでストリーミング"""
+    return await question_controller.stream_proposal(request=request, current_user=current_user)
+
+@question_router.websocket("/ws")
+async def quiz_websocket(websocket: WebSocket, token: Optional[str] = None):
+    """WebSocketでクイズを進行（回答を送ると次の質問か提案が返る）"""
+    await question_controller.quiz_websocket(websocket, token=token)
+
 @question_router.get("/session")
 async def get_session_data(
+    request: Request,
+    response: Response,
     current_user: User = Depends(get_current_active_user)
 ):
-    """現在のセッションデータを取得"""
-    return await question_controller.get_session_data(current_user=current_user)
+    """現在のセッションデータを取得（If-None-MatchがETagと一致すれば304）"""
+    return await question_controller.get_session_data(request=request, response=response, current_user=current_user)
 
 @question_router.post("/reset")
 async def reset_session(
@@ -44,3 +89,10 @@ async def reset_session(
 ):
     """セッションをリセット"""
     return await question_controller.reset_session(current_user=current_user)
+
+@question_router.get("/stats")
+async def get_stats(
+    current_user: User = Depends(get_current_active_user)
+):
+    """LLM呼び出しの統計を取得"""
+    return await question_controller.get_stats(current_user=current_user)
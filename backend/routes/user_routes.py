@@ -1,9 +1,9 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Optional
 
 from database import get_db
-from models import UserUpdate, UserResponse, User
+from models import UserUpdate, UserResponse, User, BulkUserResult
 from controllers.user_controller import UserController
 from services.auth_service import get_current_active_user
 
@@ -12,20 +12,32 @@ user_controller = UserController()
 
 @user_router.get("/", response_model=List[UserResponse])
 async def read_users(
-    skip: int = 0,
+    response: Response,
+    after: Optional[int] = None,
     limit: int = 100,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    return await user_controller.get_users(skip=skip, limit=limit, db=db, current_user=current_user)
+    """ユーザー一覧（IDの昇順。X-Next-Cursorの値をafterに渡すと次のページを取得）"""
+    return await user_controller.get_users(response=response, after=after, limit=limit, db=db, current_user=current_user)
+
+# /{user_id} より前に登録する
+@user_router.get("/export")
+async def export_users(current_user: User = Depends(get_current_active_user)):
+    """全ユーザーをNDJSONでエクスポート"""
+    return await user_controller.export_users(current_user=current_user)
 
 @user_router.get("/{user_id}", response_model=UserResponse)
 async def read_user(
     user_id: int,
+    request: Request,
+    response: Response,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    return await user_controller.get_user(user_id=user_id, db=db, current_user=current_user)
+    return await user_controller.get_user(
+        user_id=user_id, request=request, response=response, db=db, current_user=current_user
+    )
 
 @user_router.put("/{user_id}", response_model=UserResponse)
 async def update_existing_user(
@@ -43,3 +55,31 @@ async def delete_existing_user(
     current_user: User = Depends(get_current_active_user)
 ):
     return await user_controller.delete_user(user_id=user_id, db=db, current_user=current_user)
+
+# 一括処理（本文はJSON配列、またはContent-Type: application/x-ndjson のNDJSON）
+@user_router.post("/bulk/import", response_model=BulkUserResult)
+async def import_users(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """ユーザーを一括作成（各行はUserCreateと同じ形式）"""
+    return await user_controller.import_users(request=request, db=db, current_user=current_user)
+
+@user_router.post("/bulk/update", response_model=BulkUserResult)
+async def update_users(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """ユーザーを一括更新（各行はidと、UserUpdateと同じ形式の更新する項目）"""
+    return await user_controller.update_users(request=request, db=db, current_user=current_user)
+
+@user_router.post("/bulk/deactivate", response_model=BulkUserResult)
+async def deactivate_users(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """ユーザーを一括で非アクティブにする（各行は {"id": ユーザーID}）"""
+    return await user_controller.deactivate_users(request=request, db=db, current_user=current_user)
@@ -0,0 +1,134 @@
+import asyncio
+import math
+import os
+import time
+import weakref
+from collections import deque
+
+# 質問系エンドポイントの受け付け制限（環境変数で上書き可能）
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "10"))
+
+
+class AdmissionRejected(Exception):
+    """待ち行列が一杯、または待ち時間の上限を超えたためリクエストを受け付けなかった"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("リクエストが混み合っています")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """同時実行数と待ち行列の長さを制限する"""
+
+    def __init__(
+        self,
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.active = 0
+        self._waiters = deque()
+        self._avg_hold = 1.0  # 1件あたりの処理時間の指数移動平均（秒）
+        self._held_since = weakref.WeakKeyDictionary()  # タスク -> 実行枠を得た時刻
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._wait_total = 0.0
+        self.max_wait = 0.0
+
+    async def acquire(self):
+        """実行枠を取得（空きがなければ待ち行列で待つ）"""
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self._admit(0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(self.retry_after())
+
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        started = time.monotonic()
+        try:
+            done, _ = await asyncio.wait({fut}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(fut)
+            raise
+        if not done:
+            self._abandon(fut)
+            self.timed_out += 1
+            raise AdmissionRejected(self.retry_after())
+        self._admit(time.monotonic() - started)
+
+    def try_acquire(self) -> bool:
+        """待たずに取れる場合だけ実行枠を取得（投機的な処理用。待ち行列には並ばない）"""
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        return False
+
+    def release(self):
+        """実行枠を返却（待っているリクエストがあれば枠をそのまま渡す）"""
+        self._update_hold()
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def _admit(self, waited: float):
+        self.admitted += 1
+        self._wait_total += waited
+        self.max_wait = max(self.max_wait, waited)
+        task = asyncio.current_task()
+        if task is not None:
+            self._held_since[task] = time.monotonic()
+
+    def _update_hold(self):
+        # イベントループの外から呼ばれても返却はできるように、処理時間の記録だけを省く
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            return
+        if task is None:
+            return
+        started = self._held_since.pop(task, None)
+        if started is not None:
+            self._avg_hold = self._avg_hold * 0.9 + (time.monotonic() - started) * 0.1
+
+    def _abandon(self, fut: asyncio.Future):
+        if fut.done():
+            # 枠を渡された直後に諦めた場合は次のリクエストに回す
+            self.release()
+        else:
+            fut.cancel()
+            self._waiters.remove(fut)
+
+    def retry_after(self) -> int:
+        """再試行までの目安の秒数"""
+        backlog = len(self._waiters) + 1
+        return max(1, math.ceil(self._avg_hold * backlog / self.max_concurrency))
+
+    def stats(self) -> dict:
+        """実行数・待ち行列・待ち時間の統計を取得"""
+        return {
+            "active": self.active,
+            "queued": len(self._waiters),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": self._wait_total / self.admitted * 1000 if self.admitted else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
@@ -1,31 +1,21 @@
 from datetime import datetime, timedelta
 from typing import Optional
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db
+from database import AsyncSessionLocal
+from .principal_cache import Principal, principal_cache
+from .password_hasher import password_hasher
 
 # セキュリティ設定
 SECRET_KEY = "your-secret-key-here-change-in-production"  # 本番環境では環境変数から取得
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# パスワードハッシュ化の設定
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # HTTP Bearer認証
 security = HTTPBearer()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """パスワードの検証"""
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
-    """パスワードのハッシュ化"""
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """アクセストークンの作成"""
     to_encode = data.copy()
@@ -48,40 +38,57 @@ async def authenticate_user(db: AsyncSession, email: str, password: str):
     
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    # bcryptはCPUを占有するのでプロセスプールで検証する
+    if not await password_hasher.verify(password, user.hashed_password):
         return False
     return user
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_db)
-):
-    """現在のユーザーを取得"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="認証情報が無効です",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def get_principal(token: str) -> Optional[Principal]:
+    """アクセストークンから認証済みユーザーを取得（無効な場合はNone）
+
+    キャッシュにあればデータベースにはアクセスしない。
+    """
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
-            raise credentials_exception
+            return None
     except JWTError:
-        raise credentials_exception
+        return None
+    
+    principal = principal_cache.get(email)
+    if principal is not None:
+        return principal
     
     # 循環インポートを避けるために、ここで直接クエリを実行
     from sqlalchemy import select
     from models.database_models import User
     
-    result = await db.execute(select(User).where(User.email == email))
-    user = result.scalar_one_or_none()
-    
+    generation = principal_cache.generation
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(User).where(User.email == email))
+        user = result.scalar_one_or_none()
     if user is None:
+        return None
+    principal = Principal.from_user(user)
+    principal_cache.put(principal, generation)
+    return principal
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Principal:
+    """現在のユーザーを取得"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="認証情報が無効です",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    principal = await get_principal(credentials.credentials)
+    if principal is None:
         raise credentials_exception
-    return user
+    return principal
 
-async def get_current_active_user(current_user = Depends(get_current_user)):
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)) -> Principal:
     """現在のアクティブユーザーを取得"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="非アクティブなユーザーです")
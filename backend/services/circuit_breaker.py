@@ -0,0 +1,78 @@
+import time
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出しを行わなかった"""
+
+
+class CircuitBreaker:
+    """連続した失敗で呼び出しを遮断し、一定時間ごとに試行で復旧を確認する"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        """呼び出してよいか判定（半開状態では同時に1件だけ試行を許可）"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probing = False
+
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+        return True
+
+    def check(self):
+        """呼び出せない場合はCircuitOpenErrorを送出"""
+        if not self.allow():
+            raise CircuitOpenError("LLMの呼び出しを一時的に停止しています")
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self):
+        """結果を判定せずに終わった試行（呼び出し元の切断など）を取り消す"""
+        self._probing = False
+
+    def stats(self) -> dict:
+        """現在の状態を取得"""
+        retry_in = None
+        if self.state == self.OPEN:
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "retry_in_seconds": retry_in,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
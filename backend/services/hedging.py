@@ -0,0 +1,57 @@
+from collections import deque
+from typing import Optional
+
+
+class HedgePolicy:
+    """直近のレイテンシから、重複リクエスト（ヘッジ）を送るまでの待ち時間を決める"""
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        max_rate: float = 0.1,
+        min_samples: int = 20,
+        window: int = 200,
+        model: Optional[str] = None,
+    ):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.model = model  # ヘッジ先のモデル（Noneなら同じモデル）
+
+        self._latencies = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record(self, latency: float):
+        """成功した呼び出しのレイテンシを記録"""
+        self._latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        """ヘッジを送るまでの秒数（サンプル不足ならNone）"""
+        self.calls += 1
+        return self._threshold()
+
+    def _threshold(self) -> Optional[float]:
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def acquire(self) -> bool:
+        """ヘッジ率の上限内ならヘッジを1件許可"""
+        if self.hedged + 1 > self.calls * self.max_rate:
+            return False
+        self.hedged += 1
+        return True
+
+    def stats(self) -> dict:
+        """ヘッジの統計を取得"""
+        threshold = self._threshold()
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": self.hedged / self.calls if self.calls else 0.0,
+            "threshold_ms": threshold * 1000 if threshold is not None else None,
+        }
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import re
+import time
+import uuid
+from collections import deque
+from itertools import takewhile
+from typing import Awaitable, Callable, Optional
+
+# 提案生成ジョブの設定（環境変数で上書き可能）
+PROPOSAL_JOB_WORKERS = int(os.getenv("PROPOSAL_JOB_WORKERS", "4"))
+PROPOSAL_JOB_MAX_QUEUE = int(os.getenv("PROPOSAL_JOB_MAX_QUEUE", "100"))
+PROPOSAL_JOB_RESULT_TTL_SECONDS = float(os.getenv("PROPOSAL_JOB_RESULT_TTL_SECONDS", "600"))
+PROPOSAL_JOB_MAX_WAIT_SECONDS = float(os.getenv("PROPOSAL_JOB_MAX_WAIT_SECONDS", "30"))
+
+# ジョブはプロセスのメモリにだけ保持するので、ジョブIDにこのプロセスの識別子を付けて、
+# 別のワーカープロセスに届いた問い合わせを見分けられるようにする
+WORKER_ID = uuid.uuid4().hex[:8]
+JOB_ID_PATTERN = re.compile(r"([0-9a-f]{8})-[0-9a-f]{32}")
+
+
+class JobQueueFull(Exception):
+    """待ち行列が一杯のためジョブを受け付けなかった"""
+
+
+class Job:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    __slots__ = ("id", "user_id", "fn", "status", "result", "error", "created_at", "finished_at", "done")
+
+    def __init__(self, user_id: int, fn: Callable[[], Awaitable]):
+        self.id = f"{WORKER_ID}-{uuid.uuid4().hex}"
+        self.user_id = user_id
+        self.fn = fn
+        self.status = self.QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.DONE, self.FAILED)
+
+
+class JobQueue:
+    """決まった数のワーカーでジョブを実行し、結果を一定時間保持する
+
+    ジョブの状態はプロセスごとのメモリにあるので、複数のワーカープロセスで動かす場合は
+    同じユーザーの問い合わせが同じプロセスに届くようにスティッキーな振り分けが必要。
+    """
+
+    def __init__(
+        self,
+        workers: int = PROPOSAL_JOB_WORKERS,
+        max_queue: int = PROPOSAL_JOB_MAX_QUEUE,
+        result_ttl: float = PROPOSAL_JOB_RESULT_TTL_SECONDS,
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._jobs = {}
+        self._active = {}  # ユーザーID -> 未完了のジョブ
+        self._finished = deque()  # 完了順の (完了時刻, ジョブID)
+        self.running = 0
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._run_total = 0.0
+        self._wait_total = 0.0
+
+    def _start(self):
+        # ワーカーは最初の登録時に起動する（実行中のイベントループが必要なため）
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def active(self, user_id: int) -> Optional[Job]:
+        """ユーザーの未完了のジョブを取得"""
+        return self._active.get(user_id)
+
+    def submit(self, user_id: int, fn: Callable[[], Awaitable]) -> Job:
+        """ジョブを登録（待ち行列が一杯ならJobQueueFull）"""
+        self._expire()
+        if self._queue is None:
+            self._start()
+        if self._queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            raise JobQueueFull("ジョブの待ち行列が一杯です")
+
+        job = Job(user_id, fn)
+        self._jobs[job.id] = job
+        self._active[user_id] = job
+        self._queue.put_nowait(job)
+        self.submitted += 1
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """ジョブを取得（存在しないか期限切れならNone）"""
+        self._expire()
+        return self._jobs.get(job_id)
+
+    @staticmethod
+    def is_remote(job_id: str) -> bool:
+        """別のワーカープロセスで登録されたジョブのIDかどうか（形式が正しくないIDはFalse）"""
+        match = JOB_ID_PATTERN.fullmatch(job_id)
+        return match is not None and match.group(1) != WORKER_ID
+
+    async def wait(self, job: Job, timeout: float) -> Job:
+        """ジョブの完了を最大timeout秒待つ（ロングポーリング用）"""
+        if not job.finished and timeout > 0:
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return job
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self.running += 1
+            job.status = Job.RUNNING
+            started = time.monotonic()
+            self._wait_total += started - job.created_at
+            try:
+                job.result = await job.fn()
+                job.status = Job.DONE
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.error = e
+                job.status = Job.FAILED
+                self.failed += 1
+            finally:
+                self.running -= 1
+                job.fn = None
+                job.finished_at = time.monotonic()
+                self._run_total += job.finished_at - started
+                self._finished.append((job.finished_at, job.id))
+                if self._active.get(job.user_id) is job:
+                    del self._active[job.user_id]
+                job.done.set()
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._finished and now - self._finished[0][0] >= self.result_ttl:
+            _, job_id = self._finished.popleft()
+            self._jobs.pop(job_id, None)
+
+    def stats(self) -> dict:
+        """待ち行列の長さと処理量の統計を取得"""
+        self._expire()
+        now = time.monotonic()
+        finished = self.completed + self.failed
+        last_minute = sum(1 for _ in takewhile(lambda item: now - item[0] < 60, reversed(self._finished)))
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": self.running,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "retained": len(self._jobs),
+            "throughput_per_minute": last_minute,
+            "avg_wait_ms": self._wait_total / finished * 1000 if finished else 0.0,
+            "avg_run_ms": self._run_total / finished * 1000 if finished else 0.0,
+        }
+
+    def close(self):
+        """ワーカーを停止"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
@@ -0,0 +1,161 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+# キャッシュの設定（環境変数で上書き可能）
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./llm_cache.db")
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "1024"))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", "50000"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "86400"))
+LLM_CACHE_MAX_VALUE_BYTES = int(os.getenv("LLM_CACHE_MAX_VALUE_BYTES", "16384"))
+
+
+def make_cache_key(prompt: str, model: str) -> str:
+    """正規化したプロンプトとモデル名からキーを作成"""
+    normalized = "\n".join(" ".join(line.split()) for line in prompt.strip().splitlines())
+    return hashlib.sha256(f"{model}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """LLM応答の2層キャッシュ（メモリLRU + SQLite）"""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        memory_entries: int = LLM_CACHE_MEMORY_ENTRIES,
+        disk_entries: int = LLM_CACHE_DISK_ENTRIES,
+        ttl: float = LLM_CACHE_TTL_SECONDS,
+        max_value_bytes: int = LLM_CACHE_MAX_VALUE_BYTES,
+    ):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self.max_value_bytes = max_value_bytes
+
+        # key -> (value, expires_at)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._puts_since_trim = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # SQLiteへのアクセスは専用スレッド1本に直列化する
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-cache")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_accessed ON llm_cache (accessed_at)")
+        self._conn.commit()
+
+    async def get(self, prompt: str, model: str) -> Optional[str]:
+        """キャッシュから応答を取得（なければNone）"""
+        key = make_cache_key(prompt, model)
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            del self._memory[key]
+
+        loop = asyncio.get_running_loop()
+        row = await loop.run_in_executor(self._executor, self._disk_get, key, now)
+        if row is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = row
+        self._remember(key, value, expires_at)
+        self.disk_hits += 1
+        return value
+
+    def put(self, prompt: str, model: str, value: str, ttl: Optional[float] = None):
+        """応答をキャッシュに保存（ディスクへの書き込みは非同期）"""
+        if not value or len(value.encode("utf-8")) > self.max_value_bytes:
+            return
+        key = make_cache_key(prompt, model)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._remember(key, value, expires_at)
+        self._executor.submit(self._disk_put, key, model, value, expires_at)
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            self._conn.commit()
+            return None
+        self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+        return row
+
+    def _disk_put(self, key: str, model: str, value: str, expires_at: float):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, model, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, model, value, expires_at, now),
+        )
+        self._puts_since_trim += 1
+        # 件数上限の確認は一定間隔でまとめて行う
+        if self._puts_since_trim >= 100:
+            self._puts_since_trim = 0
+            self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                """DELETE FROM llm_cache WHERE key IN (
+                    SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.disk_entries,),
+            )
+        self._conn.commit()
+
+    def clear(self):
+        """キャッシュを全削除"""
+        self._memory.clear()
+        self._executor.submit(self._disk_clear)
+
+    def _disk_clear(self):
+        self._conn.execute("DELETE FROM llm_cache")
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        """ヒット率などの統計を取得"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        """書き込みを完了させて接続を閉じる"""
+        self._executor.shutdown(wait=True)
+        self._conn.close()
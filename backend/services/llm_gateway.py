@@ -0,0 +1,355 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from google.genai import errors, types
+from google.genai._api_client import ApiClient, HttpResponse, RequestJsonEncoder
+from google.genai.models import Models
+
+from .llm_cache import LLMCache, LLM_CACHE_ENABLED, make_cache_key
+from .single_flight import SingleFlight
+from .circuit_breaker import CircuitBreaker
+from .hedging import HedgePolicy
+
+load_dotenv()  # .envファイルはプロセス起動時に1回だけ読み込む
+
+# LLM呼び出しの設定（環境変数で上書き可能）
+DEFAULT_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "30"))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "15"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL") or None
+
+
+class _PooledApiClient(ApiClient):
+    """共有のrequests.Sessionでkeep-alive接続を再利用するApiClient
+
+    google-genai 0.1.0 はリクエストごとに新しいSessionを作るため、
+    送信部分だけを差し替えてコネクションプールとタイムアウトを効かせる。
+    """
+
+    def __init__(self, session: requests.Session, timeout: tuple, **kwargs):
+        super().__init__(**kwargs)
+        self._session = session
+        self._timeout = timeout
+
+    def _request_unauthorized(self, http_request, stream: bool = False) -> HttpResponse:
+        data = None
+        if http_request.data:
+            if not isinstance(http_request.data, bytes):
+                data = json.dumps(http_request.data, cls=RequestJsonEncoder)
+            else:
+                data = http_request.data
+
+        prepared = requests.Request(
+            method=http_request.method,
+            url=http_request.url,
+            headers=http_request.headers,
+            data=data,
+        ).prepare()
+        response = self._session.send(prepared, stream=stream, timeout=self._timeout)
+        errors.APIError.raise_for_response(response)
+        return HttpResponse(
+            response.headers, response if stream else [response.text]
+        )
+
+
+class LLMGateway:
+    """Gemini呼び出しの非同期ゲートウェイ（プロセス全体で1つのクライアントを共有）"""
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = DEFAULT_MODEL,
+        pool_size: int = LLM_POOL_SIZE,
+        connect_timeout: float = LLM_CONNECT_TIMEOUT_SECONDS,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        deadline: float = LLM_DEADLINE_SECONDS,
+        cache: Optional[LLMCache] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        self.model = model
+        self.timeout = timeout
+        self.deadline = deadline
+        self.cache = cache
+        self.single_flight = SingleFlight()
+        # 障害時はタイムアウトを待たずに呼び出し元のフォールバックへ回す
+        self.breaker = breaker or CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+        # 遅い呼び出しに重複リクエストを送る（Noneなら無効）
+        self.hedge = hedge
+
+        # keep-alive接続をpool_size本まで保持する
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        api_client = _PooledApiClient(
+            session=self._session,
+            timeout=(connect_timeout, timeout),
+            api_key=api_key,
+        )
+        self.models = Models(api_client)
+
+        # SDKは同期I/Oなので専用スレッドで実行し、イベントループを塞がない
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="llm"
+        )
+
+        # ストリーミングの統計（最初のチャンクまでの時間と全体の時間）
+        self.streams = 0
+        self._ttfb_total = 0.0
+        self._stream_total = 0.0
+
+    async def generate(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        json_mode: bool = False,
+        on_call: Optional[Callable[[], None]] = None,
+    ) -> str:
+        """プロンプトからテキストを生成
+
+        use_cache=Falseの場合はキャッシュも同時呼び出しのまとめも行わない（毎回新しく生成する）。
+        json_mode=Trueの場合はJSONで応答させる（キャッシュのキーには含まれないのでuse_cache=Falseと併用する）。
+        on_callは実際にGeminiを呼び出すときだけ呼ぶ（キャッシュや実行中の呼び出しで済んだ場合は呼ばない）。
+        """
+        model = model or self.model
+        if not use_cache:
+            return await self._generate(prompt, model, timeout, json_mode, on_call)
+
+        if self.cache is not None:
+            cached = await self.cache.get(prompt, model)
+            if cached is not None:
+                return cached
+
+        # 同じプロンプトの同時呼び出しは1回のGemini呼び出しにまとめる（on_callは実際に呼び出す側の分だけ呼ぶ）
+        return await self.single_flight.do(
+            make_cache_key(prompt, model),
+            partial(self._generate_and_cache, prompt, model, timeout, on_call),
+        )
+
+    async def _generate_and_cache(
+        self, prompt: str, model: str, timeout: Optional[float], on_call: Optional[Callable[[], None]] = None
+    ) -> str:
+        text = await self._generate(prompt, model, timeout, on_call=on_call)
+        if self.cache is not None:
+            self.cache.put(prompt, model, text)
+        return text
+
+    async def _generate(
+        self,
+        prompt: str,
+        model: str,
+        timeout: Optional[float],
+        json_mode: bool = False,
+        on_call: Optional[Callable[[], None]] = None,
+    ) -> str:
+        self.breaker.check()
+        if on_call is not None:
+            on_call()
+        try:
+            text = await asyncio.wait_for(self._generate_hedged(prompt, model, json_mode), timeout or self.deadline)
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return text
+
+    async def _generate_hedged(self, prompt: str, model: str, json_mode: bool = False) -> str:
+        """一定時間内に応答がなければ重複リクエストを送り、先に成功した方を採用"""
+        primary = asyncio.ensure_future(self._call(prompt, model, json_mode))
+        delay = self.hedge.delay() if self.hedge is not None else None
+        if delay is None:
+            return await primary
+
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or not self.hedge.acquire():
+                return await primary
+
+            secondary = asyncio.ensure_future(self._call(prompt, self.hedge.model or model, json_mode))
+            tasks.append(secondary)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.hedge.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # 負けた方は結果を待たずに破棄する（スレッド側の通信は完了まで続く）
+            for task in tasks:
+                task.cancel()
+
+    async def _call(self, prompt: str, model: str, json_mode: bool = False) -> str:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        text = await loop.run_in_executor(
+            self._executor, partial(self._generate_sync, prompt, model, json_mode)
+        )
+        if self.hedge is not None:
+            self.hedge.record(time.perf_counter() - started)
+        return text
+
+    def _generate_sync(self, prompt: str, model: str, json_mode: bool = False) -> str:
+        config = types.GenerateContentConfig(response_mime_type="application/json") if json_mode else None
+        response = self.models.generate_content(model=model, contents=prompt, config=config)
+        return response.text or ""
+
+    async def stream(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        timeout: Optional[float] = None,
+        use_cache: bool = True,
+        on_call: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[str]:
+        """プロンプトからテキストを生成し、チャンクごとに返す（on_callはgenerateと同じ）"""
+        model = model or self.model
+        use_cache = use_cache and self.cache is not None
+        started = time.perf_counter()
+        if use_cache:
+            cached = await self.cache.get(prompt, model)
+            if cached is not None:
+                self._record_stream(started, time.perf_counter())
+                yield cached
+                return
+
+        self.breaker.check()
+        if on_call is not None:
+            on_call()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        self._executor.submit(self._stream_sync, prompt, model, loop, queue, stop)
+
+        parts = []
+        first_chunk_at = None
+        succeeded = False
+        try:
+            while True:
+                kind, value = await asyncio.wait_for(queue.get(), timeout or self.deadline)
+                if kind == "error":
+                    raise value
+                if kind == "end":
+                    break
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                parts.append(value)
+                yield value
+            succeeded = True
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        finally:
+            # 呼び出し側が途中で切断した場合もスレッド側の読み込みを止める
+            stop.set()
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.release()
+
+        self._record_stream(started, first_chunk_at or time.perf_counter())
+        if use_cache:
+            self.cache.put(prompt, model, "".join(parts))
+
+    def _stream_sync(self, prompt: str, model: str, loop, queue: asyncio.Queue, stop: threading.Event):
+        def emit(item):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                stop.set()  # イベントループが既に終了している
+
+        try:
+            for response in self.models.generate_content_stream(model=model, contents=prompt):
+                if stop.is_set():
+                    return
+                if response.text:
+                    emit(("chunk", response.text))
+            emit(("end", None))
+        except Exception as e:
+            emit(("error", e))
+
+    def _record_stream(self, started: float, first_chunk_at: float):
+        self.streams += 1
+        self._ttfb_total += first_chunk_at - started
+        self._stream_total += time.perf_counter() - started
+
+    def close(self):
+        """スレッドと接続を解放"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def stats(self) -> dict:
+        """ゲートウェイの統計を取得"""
+        return {
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "single_flight": self.single_flight.stats(),
+            "circuit_breaker": self.breaker.stats(),
+            "hedge": self.hedge.stats() if self.hedge is not None else None,
+            "stream": {
+                "count": self.streams,
+                "ttfb_avg_ms": self._ttfb_total / self.streams * 1000 if self.streams else 0.0,
+                "total_avg_ms": self._stream_total / self.streams * 1000 if self.streams else 0.0,
+            },
+        }
+
+
+_gateway: Optional[LLMGateway] = None
+
+
+def get_llm_gateway() -> LLMGateway:
+    """プロセス共通のLLMGatewayを取得"""
+    global _gateway
+    if _gateway is None:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key or api_key == "your_gemini_api_key_here":
+            raise ValueError("GEMINI_API_KEYが正しく設定されていません。環境変数GEMINI_API_KEYを設定してください。")
+        _gateway = LLMGateway(
+            api_key=api_key,
+            cache=LLMCache() if LLM_CACHE_ENABLED else None,
+            hedge=HedgePolicy(
+                percentile=LLM_HEDGE_PERCENTILE,
+                max_rate=LLM_HEDGE_MAX_RATE,
+                model=LLM_HEDGE_MODEL,
+            ) if LLM_HEDGE_ENABLED else None,
+        )
+    return _gateway
+
+
+def close_llm_gateway():
+    """プロセス共通のLLMGatewayを破棄"""
+    global _gateway
+    if _gateway is not None:
+        _gateway.close()
+        _gateway = None
@@ -0,0 +1,114 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+# パスワードのハッシュ化を行うプロセスプールの設定（環境変数で上書き可能）
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+PASSWORD_HASH_BATCH_SIZE = int(os.getenv("PASSWORD_HASH_BATCH_SIZE", "8"))
+
+# パスワードハッシュ化の設定
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password_sync(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def hash_passwords_sync(passwords: list) -> list:
+    return [pwd_context.hash(password) for password in passwords]
+
+
+def verify_password_sync(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class PasswordHasherBusy(Exception):
+    """待ち行列が一杯のためハッシュ化を受け付けなかった"""
+
+
+class PasswordHasher:
+    """bcryptをプロセスプールで実行し、イベントループを止めずに待つ
+
+    実行中と待機中の合計が上限を超えたらPasswordHasherBusyを送出する。
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.pending = 0
+
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self):
+        """プロセスプールを起動（起動済みなら何もしない）"""
+        if self._executor is None:
+            # 起動済みのスレッドを引き継がないようにspawnで起動する
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            # ワーカーは必要になるまで起動されないので、空の処理を投げて先に起動しておく
+            for _ in range(self.workers):
+                self._executor.submit(os.getpid)
+
+    async def hash(self, password: str) -> str:
+        """パスワードをハッシュ化"""
+        return await self._run(hash_password_sync, password)
+
+    async def hash_many(self, passwords: list) -> list:
+        """複数のパスワードを全ワーカーで並列にハッシュ化（一括登録用）
+
+        batch_size件ずつの処理をワーカー数ずつ投入し、終わってから次を投入するので、
+        その間に来たログインは長く待たされない。
+        """
+        batch_size = PASSWORD_HASH_BATCH_SIZE
+        hashed = []
+        wave = batch_size * self.workers
+        for start in range(0, len(passwords), wave):
+            chunk = passwords[start:start + wave]
+            results = await asyncio.gather(*(
+                self._run(hash_passwords_sync, chunk[i:i + batch_size]) for i in range(0, len(chunk), batch_size)
+            ))
+            for result in results:
+                hashed.extend(result)
+        return hashed
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """パスワードを検証"""
+        return await self._run(verify_password_sync, plain_password, hashed_password)
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy("パスワードの処理が混み合っています")
+        self.start()
+        self.pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,97 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+# 認証済みユーザーのキャッシュの設定（環境変数で上書き可能）
+PRINCIPAL_CACHE_ENABLED = os.getenv("PRINCIPAL_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# 破棄はプロセス内だけなので、複数ワーカーでは他のワーカーでの更新・無効化がこの秒数まで反映されない
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "5"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+
+
+class Principal(NamedTuple):
+    """認証済みユーザーの読み取り専用のスナップショット"""
+    id: int
+    email: str
+    full_name: Optional[str]
+    is_active: bool
+    created_at: Optional[datetime]
+    version: int
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(user.id, user.email, user.full_name, user.is_active, user.created_at, user.version)
+
+
+class PrincipalCache:
+    """トークンのsub（メールアドレス）ごとにPrincipalを一定時間保持する（件数の上限を超えたら古いものから破棄）
+
+    ユーザーの更新・削除時はinvalidateで明示的に破棄する（破棄されるのは処理したプロセスのキャッシュだけで、
+    他のワーカーのキャッシュはttlで切れるまで古いまま残る）。
+    """
+
+    def __init__(
+        self,
+        enabled: bool = PRINCIPAL_CACHE_ENABLED,
+        ttl: float = PRINCIPAL_CACHE_TTL_SECONDS,
+        max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES,
+    ):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # email -> (Principal, expires_at)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # 破棄のたびに進める（破棄より前に読んだユーザーを後から保存しないため）
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, email: str) -> Optional[Principal]:
+        """キャッシュからPrincipalを取得（なければNone）"""
+        entry = self._entries.get(email)
+        if entry is not None:
+            principal, expires_at = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(email)
+                self.hits += 1
+                return principal
+            del self._entries[email]
+        self.misses += 1
+        return None
+
+    def put(self, principal: Principal, generation: int):
+        """Principalを保存（generationは読み込み前に取得した値。その後に破棄があれば保存しない）"""
+        if not self.enabled or generation != self.generation:
+            return
+        self._entries[principal.email] = (principal, time.monotonic() + self.ttl)
+        self._entries.move_to_end(principal.email)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, *emails: str):
+        """指定したメールアドレスのPrincipalを破棄"""
+        self.generation += 1
+        self.invalidations += 1
+        for email in emails:
+            self._entries.pop(email, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,180 @@
+import os
+from typing import Optional
+
+# 履歴をプロンプトに含めるときのトークン数の上限と、そのまま残す直近の往復数（環境変数で上書き可能）
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.getenv("PROMPT_HISTORY_TOKEN_BUDGET", "400"))
+PROMPT_HISTORY_RECENT_TURNS = int(os.getenv("PROMPT_HISTORY_RECENT_TURNS", "5"))
+SUMMARY_QUESTION_CHARS = 20
+
+# 質問の種類を定義
+QUESTION_TYPES = [
+    "読書習慣について",
+    "運動習慣について",
+    "美容・健康について",
+    "人間関係について",
+    "目標設定について"
+]
+DEFAULT_QUESTION_TYPE = "全般的な自己改善について"
+
+# 回答の選択肢（先読みの候補）
+ANSWER_CHOICES = ["はい", "いいえ", "わからない"]
+
+# フォールバック質問
+FALLBACK_QUESTIONS = [
+    "あなたは毎日読書をしていますか？",
+    "週に3回以上運動をしていますか？",
+    "自分の外見や健康に気を使っていますか？",
+    "新しい人との出会いを積極的に求めていますか？",
+    "将来の目標を明確に持っていますか？"
+]
+DEFAULT_FALLBACK_QUESTION = "自分をより良くしたいと思っていますか？"
+
+# エラー時のフォールバック提案
+FALLBACK_PROPOSAL = "あなたの回答を基に、読書習慣の改善、定期的な運動、健康的な生活習慣の確立をお勧めします。小さな一歩から始めて、継続することが大切です。応援しています！"
+
+
+def fallback_question(current_num: int) -> str:
+    """質問番号に対応するフォールバック質問を取得"""
+    return FALLBACK_QUESTIONS[current_num] if current_num < len(FALLBACK_QUESTIONS) else DEFAULT_FALLBACK_QUESTION
+
+
+def format_turn(index: int, question: str, answer: str) -> str:
+    """質問と回答の1往復をプロンプト用に整形"""
+    return f"質問{index+1}: {question}\n回答{index+1}: {answer}\n"
+
+
+def build_question_prompt(
+    questions: list, answers: list, current_num: int, num_questions: int, history: Optional[str] = None
+) -> str:
+    """質問生成のプロンプトを作成（historyを渡した場合はそれを質問と回答の履歴として使う）"""
+    # 現在の質問番号に基づいて質問タイプを選択
+    question_type = QUESTION_TYPES[current_num] if current_num < len(QUESTION_TYPES) else DEFAULT_QUESTION_TYPE
+
+    if history is None:
+        history = "".join(format_turn(i, questions[i], answers[i]) for i in range(min(len(questions), len(answers))))
+
+    prompt = ""
+    if history:
+        # 前回の回答を考慮した質問を生成
+        prompt += f"これまでの質問と回答:\n"
+        prompt += history
+        prompt += f"\n前回の回答を踏まえて、次の質問を生成してください。\n"
+
+    # 質問生成のプロンプト
+    prompt += f"""あなたは自分磨きの専門家です。回答者に最適な自分磨きを提案するために、{question_type}に関する質問を1つ出してください。
+
+質問の条件:
+- 「はい」「いいえ」「わからない」で答えられるもの
+- 具体的で分かりやすい内容
+- 回答者の状況を把握するのに役立つ内容
+- 質問文のみを出力（説明は不要）
+
+現在は{current_num + 1}回目の質問です（全{num_questions}問）。"""
+    return prompt
+
+
+def build_batch_question_prompt(num_questions: int) -> str:
+    """全質問を1回で生成するプロンプトを作成（JSONの文字列配列で出力させる）"""
+    topics = ""
+    for i in range(num_questions):
+        question_type = QUESTION_TYPES[i] if i < len(QUESTION_TYPES) else DEFAULT_QUESTION_TYPE
+        topics += f"{i + 1}問目: {question_type}\n"
+
+    return f"""あなたは自分磨きの専門家です。回答者に最適な自分磨きを提案するために、以下のテーマで質問を1つずつ、全{num_questions}問出してください。
+
+{topics}
+質問の条件:
+- 「はい」「いいえ」「わからない」で答えられるもの
+- 具体的で分かりやすい内容
+- 回答者の状況を把握するのに役立つ内容
+- 質問同士が重複しないこと
+
+出力形式: 質問文の文字列を順番に{num_questions}個並べたJSON配列のみ（例: ["質問1", "質問2"]）"""
+
+
+def build_proposal_prompt(questions: list, answers: list, history: Optional[str] = None) -> str:
+    """提案生成のプロンプトを作成（historyを渡した場合は回答済みの分をそれで置き換える）"""
+    # 最適な自分磨き提案をAPIに依頼
+    summary_prompt = """あなたは経験豊富な自分磨きのアドバイザーです。以下の質問と回答を参考に、回答者に最適な自分磨きの提案をしてください。
+
+提案の条件:
+- 具体的で実践可能な内容
+- 回答者の状況に合わせた提案
+- 読書、運動、美容、人間関係、目標設定などの分野を含む
+- 100-150文字程度で簡潔に
+- 励ましの言葉も含める
+
+質問と回答:
+"""
+    if history is None:
+        history = "".join(format_turn(i, questions[i], answers[i]) for i in range(min(len(questions), len(answers))))
+    summary_prompt += history
+    for i in range(len(answers), len(questions)):
+        summary_prompt += format_turn(i, questions[i], "未回答")
+    return summary_prompt
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（日本語などは1文字≒1トークン、ASCIIは4文字≒1トークン）"""
+    ascii_chars = sum(1 for c in text if c.isascii())
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+class PromptHistory:
+    """トークン数の上限内で質問と回答の履歴を整形する
+
+    直近recent_turns件はそのまま残し、それより前は短い要約にまとめて上限に収まる分だけ残す。
+    回答が増えた分だけ整形結果を追加するので、毎回全体を作り直さない。
+    """
+
+    def __init__(self, budget: int = PROMPT_HISTORY_TOKEN_BUDGET, recent_turns: int = PROMPT_HISTORY_RECENT_TURNS):
+        self.budget = budget
+        self.recent_turns = recent_turns
+        self._questions = None
+        # 1往復ごとの (そのままの行, トークン数, 要約の行, トークン数)
+        self._turns = []
+
+    def sync(self, questions: list, answers: list):
+        """新しく回答された分を追加（リセットなどでリストが変わっていれば作り直す）"""
+        answered = min(len(questions), len(answers))
+        if questions is not self._questions or answered < len(self._turns):
+            self._questions = questions
+            self._turns = []
+        for i in range(len(self._turns), answered):
+            line = format_turn(i, questions[i], answers[i])
+            summary = f"- 質問{i+1}「{_shorten(questions[i], SUMMARY_QUESTION_CHARS)}」: {answers[i]}\n"
+            self._turns.append((line, estimate_tokens(line), summary, estimate_tokens(summary)))
+
+    def render(self, extra: Optional[tuple] = None) -> str:
+        """履歴を整形（extraに(質問, 回答)を渡すと最後の1往復として仮に加える）"""
+        turns = self._turns
+        if extra is not None:
+            line = format_turn(len(turns), *extra)
+            turns = turns + [(line, estimate_tokens(line), "", 0)]
+        if not turns:
+            return ""
+
+        split = max(0, len(turns) - self.recent_turns)
+        recent = turns[split:]
+        remaining = self.budget - sum(tokens for _, tokens, _, _ in recent)
+
+        # 古い往復は新しいものから順に、上限に収まる分だけ要約を残す
+        summaries = []
+        for _, _, summary, tokens in reversed(turns[:split]):
+            if tokens > remaining:
+                break
+            summaries.append(summary)
+            remaining -= tokens
+        omitted = split - len(summaries)
+
+        text = ""
+        if split:
+            text += f"（質問1〜{split}の要約）\n"
+            if omitted:
+                text += f"- ほか{omitted}件\n"
+            text += "".join(reversed(summaries))
+        return text + "".join(line for line, _, _, _ in recent)
+
+
+def _shorten(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + "…"
@@ -0,0 +1,118 @@
+import os
+import zlib
+from typing import Optional
+
+import numpy as np
+
+# 類似した回答履歴の提案を再利用するキャッシュの設定（既定では無効）
+PROPOSAL_CACHE_ENABLED = os.getenv("PROPOSAL_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+PROPOSAL_CACHE_THRESHOLD = float(os.getenv("PROPOSAL_CACHE_THRESHOLD", "0.95"))
+PROPOSAL_CACHE_CAPACITY = int(os.getenv("PROPOSAL_CACHE_CAPACITY", "1024"))
+PROPOSAL_CACHE_DIM = int(os.getenv("PROPOSAL_CACHE_DIM", "2048"))
+
+NGRAM_SIZES = (2, 3)
+ANSWER_WEIGHT = 2.0  # 回答の違いが質問文の言い回しの違いより効くように重みを付ける
+
+
+def embed_transcript(questions: list, answers: list, dim: int = PROPOSAL_CACHE_DIM) -> np.ndarray:
+    """質問と回答を文字n-gramのハッシュで固定長の単位ベクトルにする
+
+    質問文のn-gramに加え、回答と組み合わせたn-gramも特徴にする。
+    """
+    indices = []
+    weights = []
+    for question, answer in zip(questions, answers):
+        for n in NGRAM_SIZES:
+            for i in range(len(question) - n + 1):
+                gram = question[i:i + n]
+                indices.append(zlib.crc32(gram.encode("utf-8")) % dim)
+                weights.append(1.0)
+                indices.append(zlib.crc32(f"{gram}\x00{answer}".encode("utf-8")) % dim)
+                weights.append(ANSWER_WEIGHT)
+
+    vector = np.bincount(indices, weights=weights, minlength=dim).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class ProposalCache:
+    """回答履歴のベクトルとコサイン類似度で提案を引くキャッシュ（件数の上限を超えたら最も古く使われたものを破棄）"""
+
+    def __init__(
+        self,
+        threshold: float = PROPOSAL_CACHE_THRESHOLD,
+        capacity: int = PROPOSAL_CACHE_CAPACITY,
+        dim: int = PROPOSAL_CACHE_DIM,
+    ):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.dim = dim
+
+        # 行ごとに1件（単位ベクトルなので内積がそのままコサイン類似度）
+        self._vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._proposals = []
+        self._clock = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, questions: list, answers: list) -> Optional[str]:
+        """類似度がしきい値以上の提案を取得（なければNone）"""
+        count = len(self._proposals)
+        if count == 0:
+            self.misses += 1
+            return None
+
+        similarities = self._vectors[:count] @ embed_transcript(questions, answers, self.dim)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touch(best)
+        return self._proposals[best]
+
+    def put(self, questions: list, answers: list, proposal: str):
+        """提案を追加（一杯なら最も古く使われた行を置き換える）"""
+        vector = embed_transcript(questions, answers, self.dim)
+        if len(self._proposals) < self.capacity:
+            row = len(self._proposals)
+            self._proposals.append(proposal)
+        else:
+            row = int(np.argmin(self._last_used))
+            self._proposals[row] = proposal
+            self.evicted += 1
+        self._vectors[row] = vector
+        self._touch(row)
+
+    def _touch(self, row: int):
+        self._clock += 1
+        self._last_used[row] = self._clock
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._proposals),
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_cache: Optional[ProposalCache] = None
+
+
+def get_proposal_cache() -> Optional[ProposalCache]:
+    """提案キャッシュを取得（無効ならNone）"""
+    global _cache
+    if not PROPOSAL_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = ProposalCache()
+    return _cache
@@ -0,0 +1,139 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from .llm_gateway import get_llm_gateway
+from .prompts import QUESTION_TYPES, build_question_prompt
+
+# 事前生成プールの設定（環境変数で上書き可能）
+QUESTION_POOL_ENABLED = os.getenv("QUESTION_POOL_ENABLED", "true").lower() in ("1", "true", "yes")
+QUESTION_POOL_DEPTH = int(os.getenv("QUESTION_POOL_DEPTH", "5"))
+QUESTION_POOL_LOW_WATER = int(os.getenv("QUESTION_POOL_LOW_WATER", "2"))
+QUESTION_POOL_TTL_SECONDS = float(os.getenv("QUESTION_POOL_TTL_SECONDS", "3600"))
+QUESTION_POOL_NUM_QUESTIONS = int(os.getenv("QUESTION_POOL_NUM_QUESTIONS", "5"))
+
+
+class QuestionPool:
+    """履歴のない質問（最初の質問）を質問タイプごとに事前生成しておくプール"""
+
+    def __init__(
+        self,
+        depth: int = QUESTION_POOL_DEPTH,
+        low_water: int = QUESTION_POOL_LOW_WATER,
+        ttl: float = QUESTION_POOL_TTL_SECONDS,
+    ):
+        self.llm = get_llm_gateway()
+        self.depth = depth
+        self.low_water = low_water
+        self.ttl = ttl
+
+        # (質問番号, 全質問数) -> deque[(質問, 有効期限)]（キーはstartで登録したものだけ）
+        self._items = {}
+        self._refills = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.expired = 0
+
+    def start(self, num_questions: int = QUESTION_POOL_NUM_QUESTIONS):
+        """全質問タイプのプールの補充を開始"""
+        for current_num in range(min(len(QUESTION_TYPES), num_questions)):
+            key = (current_num, num_questions)
+            self._items.setdefault(key, deque())
+            self._schedule_refill(key)
+
+    def take(self, current_num: int, num_questions: int) -> Optional[str]:
+        """プールから質問を1つ取り出す（なければNone）
+
+        num_questionsはクライアントが指定する値なので、startで登録したキー以外はプールを作らず補充もしない。
+        """
+        key = (current_num, num_questions)
+        if key not in self._items:
+            return None
+        items = self._drop_expired(key)
+        question = items.popleft() if items else None
+        if question is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        if len(items) < self.low_water:
+            self._schedule_refill(key)
+        return question[0] if question else None
+
+    def _drop_expired(self, key: tuple) -> deque:
+        items = self._items[key]
+        now = time.time()
+        while items and items[0][1] <= now:
+            items.popleft()
+            self.expired += 1
+        return items
+
+    def _schedule_refill(self, key: tuple):
+        task = self._refills.get(key)
+        if task is None or task.done():
+            self._refills[key] = asyncio.create_task(self._refill(key))
+
+    async def _refill(self, key: tuple):
+        """プールをdepthまで補充（失敗した分は次回の取り出し時に再試行）"""
+        current_num, num_questions = key
+        missing = self.depth - len(self._drop_expired(key))
+        if missing <= 0:
+            return
+
+        prompt = build_question_prompt([], [], current_num, num_questions)
+        # 同じプロンプトでもばらつきが出るようにキャッシュは使わない
+        results = await asyncio.gather(
+            *(self.llm.generate(prompt, use_cache=False) for _ in range(missing)),
+            return_exceptions=True,
+        )
+
+        items = self._drop_expired(key)
+        pooled = {question for question, _ in items}
+        expires_at = time.time() + self.ttl
+        for result in results:
+            if isinstance(result, BaseException):
+                continue
+            question = result.strip()
+            if len(question) < 10 or question in pooled or len(items) >= self.depth:
+                continue
+            items.append((question, expires_at))
+            pooled.add(question)
+            self.generated += 1
+
+    def stats(self) -> dict:
+        """プールの状態を取得"""
+        return {
+            "sizes": {f"{num}/{total}": len(items) for (num, total), items in self._items.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "generated": self.generated,
+            "expired": self.expired,
+        }
+
+    def close(self):
+        """補充タスクを停止"""
+        for task in self._refills.values():
+            task.cancel()
+        self._refills = {}
+
+
+_pool: Optional[QuestionPool] = None
+
+
+def get_question_pool() -> Optional[QuestionPool]:
+    """プロセス共通のQuestionPoolを取得（無効化されている場合はNone）"""
+    global _pool
+    if _pool is None and QUESTION_POOL_ENABLED:
+        _pool = QuestionPool()
+    return _pool
+
+
+def close_question_pool():
+    """プロセス共通のQuestionPoolを破棄"""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
@@ -1,144 +1,373 @@
-from dotenv import load_dotenv
+import asyncio
+import json
+import math
 import os
-from google import genai
+import time
+from functools import partial
+from typing import AsyncIterator, Optional
+
+from .llm_gateway import get_llm_gateway
+from .question_pool import get_question_pool
+from .question_tree import get_question_tree
+from .proposal_cache import get_proposal_cache
+from .usage_service import (
+    QuotaLimiter, usage_meter,
+    QUOTA_QUESTION_PER_MINUTE, QUOTA_QUESTION_BURST, QUOTA_PROPOSAL_PER_MINUTE, QUOTA_PROPOSAL_BURST
+)
+from .session_store import QuizSession
+from .admission import AdmissionController
+from .prompts import (
+    ANSWER_CHOICES, FALLBACK_PROPOSAL, PromptHistory, fallback_question,
+    build_question_prompt, build_batch_question_prompt, build_proposal_prompt
+)
+
+# 投機的な先読みの設定（既定では無効）
+QUESTION_PREFETCH_ENABLED = os.getenv("QUESTION_PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes")
+QUESTION_PREFETCH_MAX_INFLIGHT = int(os.getenv("QUESTION_PREFETCH_MAX_INFLIGHT", "3"))
+
+
+class PrefetchMetrics:
+    """先読みの利用状況（プロセス全体で集計）"""
 
-class QuestionService:
     def __init__(self):
-        load_dotenv()  # .envファイルを読み込む
-        self.api_key = os.getenv("GEMINI_API_KEY")
-        if not self.api_key or self.api_key == "your_gemini_api_key_here":
-            raise ValueError("GEMINI_API_KEYが正しく設定されていません。環境変数GEMINI_API_KEYを設定してください。")
-        self.client = genai.Client(api_key=self.api_key)
+        self.started = 0
+        self.used = 0
+        self.wasted = 0
+        self.missed = 0
+        self.skipped = 0  # 実行枠や生成回数の上限の空きがなく始めなかった分
+
+    def snapshot(self) -> dict:
+        finished = self.used + self.wasted
+        return {
+            "started": self.started,
+            "used": self.used,
+            "wasted": self.wasted,
+            "missed": self.missed,
+            "skipped": self.skipped,
+            "waste_rate": self.wasted / finished if finished else 0.0,
+        }
+
+
+prefetch_metrics = PrefetchMetrics()
+
+
+class QuestionService:
+    """クイズの進行（セッションの状態はQuizSessionとして呼び出し側が渡す）"""
+
+    def __init__(
+        self,
+        prefetch: bool = QUESTION_PREFETCH_ENABLED,
+        prefetch_max_inflight: int = QUESTION_PREFETCH_MAX_INFLIGHT,
+        admission: Optional[AdmissionController] = None,
+    ):
+        # Geminiクライアントはプロセス全体で共有する
+        self.llm = get_llm_gateway()
+        self.pool = get_question_pool()
+        self.tree = get_question_tree()
+        self.proposal_cache = get_proposal_cache()
         self.char_code = 'utf-8'
-        
-        # メモリベースの保存に変更
-        self.questions = []
-        self.answers = []
 
-    def reset_session(self):
+        self.prefetch = prefetch
+        self.prefetch_max_inflight = prefetch_max_inflight
+        # 先読みもリクエストと同じ実行枠の範囲で行う
+        self.admission = admission
+
+        # ユーザーごとの生成回数の上限（実際にLLMを呼び出したときだけ消費する）
+        self.quotas = {
+            "question": QuotaLimiter(QUOTA_QUESTION_PER_MINUTE, QUOTA_QUESTION_BURST),
+            "proposal": QuotaLimiter(QUOTA_PROPOSAL_PER_MINUTE, QUOTA_PROPOSAL_BURST),
+        }
+
+    def reset_session(self, session: QuizSession):
         """セッションをリセット"""
-        self.questions = []
-        self.answers = []
+        self.discard_prefetch(session)
+        session.questions = []
+        session.answers = []
+        session.proposal = None
+        session.planned = []
 
-    def get_question(self, current_num: int, num_questions: int = 5) -> str:
-        """新しい質問を生成"""
+    async def get_question(self, session: QuizSession, current_num: int, num_questions: int = 5, mode: str = "adaptive") -> str:
+        """新しい質問を生成（mode="batch"なら全質問を1回で生成して順に返す）"""
         if current_num >= num_questions:
             raise ValueError("質問数の上限に達しました")
-        
-        # 質問の種類を定義
-        question_types = [
-            "読書習慣について",
-            "運動習慣について", 
-            "美容・健康について",
-            "人間関係について",
-            "目標設定について"
-        ]
-        
-        # 現在の質問番号に基づいて質問タイプを選択
-        question_type = question_types[current_num] if current_num < len(question_types) else "全般的な自己改善について"
-        
-        prompt = ""
-        if len(self.questions) > 0 and len(self.answers) > 0:
-            # 前回の回答を考慮した質問を生成
-            prompt += f"これまでの質問と回答:\n"
-            for i in range(len(self.questions)):
-                if i < len(self.answers):
-                    prompt += f"質問{i+1}: {self.questions[i]}\n回答{i+1}: {self.answers[i]}\n"
-            prompt += f"\n前回の回答を踏まえて、次の質問を生成してください。\n"
-
-        # 質問生成のプロンプト
-        prompt += f"""あなたは自分磨きの専門家です。回答者に最適な自分磨きを提案するために、{question_type}に関する質問を1つ出してください。
-
-質問の条件:
-- 「はい」「いいえ」「わからない」で答えられるもの
-- 具体的で分かりやすい内容
-- 回答者の状況を把握するのに役立つ内容
-- 質問文のみを出力（説明は不要）
-
-現在は{current_num + 1}回目の質問です（全{num_questions}問）。"""
-        
-        try:
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash", contents=prompt
+
+        question = await self._ready_question(session, current_num, num_questions, mode)
+        if question is None:
+            prompt = build_question_prompt(
+                session.questions, session.answers, current_num, num_questions, self._history(session)
+            )
+            question = await self._generate_question(session, prompt, current_num)
+
+        self._store_question(session, question, current_num, num_questions)
+        return question
+
+    def stream_question(
+        self, session: QuizSession, current_num: int, num_questions: int = 5, mode: str = "adaptive"
+    ) -> AsyncIterator[str]:
+        """新しい質問をストリーミングで生成（チャンクを順に返す）"""
+        if current_num >= num_questions:
+            raise ValueError("質問数の上限に達しました")
+        return self._stream_question(session, current_num, num_questions, mode)
+
+    async def _stream_question(
+        self, session: QuizSession, current_num: int, num_questions: int, mode: str
+    ) -> AsyncIterator[str]:
+        question = await self._ready_question(session, current_num, num_questions, mode)
+        if question is not None:
+            yield question
+        else:
+            prompt = build_question_prompt(
+                session.questions, session.answers, current_num, num_questions, self._history(session)
             )
-            question = response.text.strip()
-            
+            parts = []
+            try:
+                async for chunk in self._stream(session, prompt, "question"):
+                    parts.append(chunk)
+                    yield chunk
+                question = "".join(parts).strip()
+            except Exception:
+                question = ""
+
+            # 質問が空でないことを確認（確定した質問は呼び出し側がquestions[-1]で取得する）
+            if not question or len(question) < 10:
+                question = fallback_question(current_num)
+
+        self._store_question(session, question, current_num, num_questions)
+
+    async def _ready_question(
+        self, session: QuizSession, current_num: int, num_questions: int, mode: str = "adaptive"
+    ) -> Optional[str]:
+        """一括生成、質問ツリー、先読みや事前生成で既に用意されている質問を取得"""
+        if mode == "batch":
+            # 一括生成は最初の質問のときだけ行う（失敗したら空のままにして、以降は1問ずつの生成にする）
+            if current_num == 0:
+                session.planned = await self._generate_batch(session, num_questions)
+            if len(session.planned) == num_questions and current_num < num_questions:
+                return session.planned[current_num]
+        if self.tree is not None and current_num == len(session.answers):
+            question = self.tree.lookup(session.answers, num_questions)
+            if question is not None:
+                return question
+        task = self._take_prefetch(session, current_num)
+        if task is not None:
+            return await task
+        if len(session.answers) == 0 and self.pool is not None:
+            # 履歴がなければプロンプトは全員共通なので事前生成済みの質問を使う
+            return self.pool.take(current_num, num_questions)
+        return None
+
+    def _store_question(self, session: QuizSession, question: str, current_num: int, num_questions: int):
+        """質問を保存し、必要なら次の質問の先読みを開始"""
+        session.questions.append(question)
+        if self.prefetch and self.tree is None and not session.planned:
+            self._start_prefetch(session, current_num + 1, num_questions)
+
+    async def _generate_question(self, session: QuizSession, prompt: str, current_num: int) -> str:
+        """プロンプトから質問を生成（失敗時はフォールバック質問）"""
+        try:
+            question = (await self._generate(session, prompt, "question")).strip()
+
             # 質問が空でないことを確認
             if not question or len(question) < 10:
-                # フォールバック質問
-                fallback_questions = [
-                    "あなたは毎日読書をしていますか？",
-                    "週に3回以上運動をしていますか？",
-                    "自分の外見や健康に気を使っていますか？",
-                    "新しい人との出会いを積極的に求めていますか？",
-                    "将来の目標を明確に持っていますか？"
-                ]
-                question = fallback_questions[current_num] if current_num < len(fallback_questions) else "自分をより良くしたいと思っていますか？"
-            
-        except Exception as e:
+                question = fallback_question(current_num)
+
+        except Exception:
             # エラー時のフォールバック質問
-            fallback_questions = [
-                "あなたは毎日読書をしていますか？",
-                "週に3回以上運動をしていますか？",
-                "自分の外見や健康に気を使っていますか？",
-                "新しい人との出会いを積極的に求めていますか？",
-                "将来の目標を明確に持っていますか？"
-            ]
-            question = fallback_questions[current_num] if current_num < len(fallback_questions) else "自分をより良くしたいと思っていますか？"
-        
-        # 質問を保存
-        self.questions.append(question)
+            question = fallback_question(current_num)
         return question
 
-    def save_answer(self, answer: str, current_num: int):
+    def _history(self, session: QuizSession, extra: Optional[tuple] = None) -> str:
+        """セッションの質問と回答の履歴をトークン数の上限内で整形（前回からの差分だけ追加する）"""
+        if session.history is None:
+            session.history = PromptHistory()
+        session.history.sync(session.questions, session.answers)
+        return session.history.render(extra)
+
+    async def _generate_batch(self, session: QuizSession, num_questions: int) -> list:
+        """全質問をJSONで1回で生成（形式が正しくなければ空のリストを返し、1問ずつの生成に戻す）"""
+        prompt = build_batch_question_prompt(num_questions)
+        try:
+            text = await self._generate(session, prompt, "question", json_mode=True)
+            questions = json.loads(text)
+        except Exception:
+            return []
+
+        if isinstance(questions, dict):
+            questions = questions.get("questions")
+        if not isinstance(questions, list) or len(questions) != num_questions:
+            return []
+        planned = []
+        for current_num, question in enumerate(questions):
+            question = question.strip() if isinstance(question, str) else ""
+            # 質問が空でないことを確認
+            if len(question) < 10:
+                question = fallback_question(current_num)
+            planned.append(question)
+        return planned
+
+    async def _generate(self, session: QuizSession, prompt: str, kind: str, json_mode: bool = False) -> str:
+        """LLMで生成し、利用量を記録"""
+        started = time.perf_counter()
+        on_call = partial(self.quotas[kind].consume, session.user_id)
+        if json_mode:
+            # 一括生成は毎回違う質問にしたいのでキャッシュしない
+            text = await self.llm.generate(prompt, use_cache=False, json_mode=True, on_call=on_call)
+        else:
+            text = await self.llm.generate(prompt, on_call=on_call)
+        usage_meter.record(session.user_id, kind, prompt, text, time.perf_counter() - started)
+        return text
+
+    async def _stream(self, session: QuizSession, prompt: str, kind: str) -> AsyncIterator[str]:
+        """LLMでストリーミング生成し、完了時に利用量を記録"""
+        started = time.perf_counter()
+        parts = []
+        async for chunk in self.llm.stream(prompt, on_call=partial(self.quotas[kind].consume, session.user_id)):
+            parts.append(chunk)
+            yield chunk
+        usage_meter.record(session.user_id, kind, prompt, "".join(parts), time.perf_counter() - started)
+
+    def _start_prefetch(self, session: QuizSession, next_num: int, num_questions: int):
+        """想定される回答ごとに次の質問の生成を開始"""
+        self.discard_prefetch(session)
+        if next_num >= num_questions:
+            return
+
+        session.prefetch_num = next_num
+        # 生成回数の上限は実際の次のリクエストの1回分を残した範囲で使う
+        budget = min(self.prefetch_max_inflight, math.floor(self.quotas["question"].remaining(session.user_id)) - 1)
+        choices = ANSWER_CHOICES[:self.prefetch_max_inflight]
+        for i, answer in enumerate(choices):
+            # 実行枠に空きがなければ待たずにやめる（先読みで実際のリクエストを待たせない）
+            if i >= budget or (self.admission is not None and not self.admission.try_acquire()):
+                prefetch_metrics.skipped += len(choices) - i
+                break
+            history = self._history(session, (session.questions[len(session.answers)], answer))
+            prompt = build_question_prompt(session.questions, session.answers + [answer], next_num, num_questions, history)
+            task = asyncio.create_task(self._generate_question(session, prompt, next_num))
+            if self.admission is not None:
+                # 開始前に取り消された場合も返却されるように完了時のコールバックで返す
+                task.add_done_callback(lambda _: self.admission.release())
+            session.prefetch_tasks[answer] = task
+            prefetch_metrics.started += 1
+
+    def _keep_prefetch(self, session: QuizSession, answer: str):
+        """実際の回答に一致する先読みだけを残す"""
+        next_num = session.prefetch_num
+        if next_num is None:
+            return
+        kept = session.prefetch_tasks.pop(answer, None)
+        self.discard_prefetch(session)
+        if kept is None:
+            prefetch_metrics.missed += 1
+            return
+        session.prefetch_num = next_num
+        session.prefetch_tasks = {answer: kept}
+
+    def _take_prefetch(self, session: QuizSession, current_num: int):
+        """この質問番号に使える先読みタスクを取り出す"""
+        if (
+            session.prefetch_num != current_num
+            or len(session.questions) != current_num
+            or len(session.answers) != current_num
+            or len(session.prefetch_tasks) != 1
+        ):
+            self.discard_prefetch(session)
+            return None
+        _, task = session.prefetch_tasks.popitem()
+        session.prefetch_num = None
+        prefetch_metrics.used += 1
+        return task
+
+    def discard_prefetch(self, session: QuizSession):
+        """未使用の先読みを取り消す"""
+        for task in session.prefetch_tasks.values():
+            task.cancel()
+            prefetch_metrics.wasted += 1
+        session.prefetch_tasks = {}
+        session.prefetch_num = None
+
+    def save_answer(self, session: QuizSession, answer: str, current_num: int):
         """回答を保存"""
-        if current_num != len(self.answers):
+        if current_num != len(session.answers):
             raise ValueError("回答の順序が正しくありません")
-        
-        if current_num >= len(self.questions):
+
+        if current_num >= len(session.questions):
             raise ValueError("対応する質問が存在しません")
-        
-        self.answers.append(answer)
 
-    def get_proposal(self) -> str:
-        """自分磨きの提案を生成"""
-        if len(self.questions) == 0:
+        session.answers.append(answer)
+        self._keep_prefetch(session, answer)
+
+    def check_proposal(self, session: QuizSession):
+        """提案を生成できる状態か確認"""
+        if len(session.questions) == 0:
             raise ValueError("質問がありません")
-        
-        if len(self.answers) == 0:
+
+        if len(session.answers) == 0:
             raise ValueError("回答がありません")
-        
-        # 最適な自分磨き提案をAPIに依頼
-        summary_prompt = """あなたは経験豊富な自分磨きのアドバイザーです。以下の質問と回答を参考に、回答者に最適な自分磨きの提案をしてください。
-
-提案の条件:
-- 具体的で実践可能な内容
-- 回答者の状況に合わせた提案
-- 読書、運動、美容、人間関係、目標設定などの分野を含む
-- 100-150文字程度で簡潔に
-- 励ましの言葉も含める
-
-質問と回答:
-"""
-        for i in range(len(self.questions)):
-            if i < len(self.answers):
-                summary_prompt += f"質問{i+1}: {self.questions[i]}\n回答{i+1}: {self.answers[i]}\n"
-            else:
-                summary_prompt += f"質問{i+1}: {self.questions[i]}\n回答{i+1}: 未回答\n"
-        
+
+    async def get_proposal(self, session: QuizSession) -> str:
+        """自分磨きの提案を生成"""
+        self.check_proposal(session)
+
+        cached = self._cached_proposal(session)
+        if cached is not None:
+            session.proposal = cached
+            return session.proposal
+
+        summary_prompt = build_proposal_prompt(session.questions, session.answers, self._history(session))
+
         try:
-            response = self.client.models.generate_content(
-                model="gemini-2.5-flash", contents=summary_prompt
-            )
-            return response.text.strip()
-        except Exception as e:
+            session.proposal = (await self._generate(session, summary_prompt, "proposal")).strip()
+            self._cache_proposal(session)
+        except Exception:
             # エラー時のフォールバック提案
-            return "あなたの回答を基に、読書習慣の改善、定期的な運動、健康的な生活習慣の確立をお勧めします。小さな一歩から始めて、継続することが大切です。応援しています！"
+            session.proposal = FALLBACK_PROPOSAL
+        return session.proposal
+
+    def stream_proposal(self, session: QuizSession) -> AsyncIterator[str]:
+        """自分磨きの提案をストリーミングで生成（チャンクを順に返す）"""
+        self.check_proposal(session)
+
+        return self._stream_proposal(
+            session, build_proposal_prompt(session.questions, session.answers, self._history(session))
+        )
+
+    async def _stream_proposal(self, session: QuizSession, summary_prompt: str) -> AsyncIterator[str]:
+        cached = self._cached_proposal(session)
+        if cached is not None:
+            session.proposal = cached
+            yield cached
+            return
+
+        parts = []
+        try:
+            async for chunk in self._stream(session, summary_prompt, "proposal"):
+                parts.append(chunk)
+                yield chunk
+            session.proposal = "".join(parts).strip() or FALLBACK_PROPOSAL
+            self._cache_proposal(session)
+        except Exception:
+            # エラー時のフォールバック提案
+            session.proposal = FALLBACK_PROPOSAL
+            if not parts:
+                yield FALLBACK_PROPOSAL
+
+    def _cached_proposal(self, session: QuizSession) -> Optional[str]:
+        """回答履歴が類似したセッションの提案を取得"""
+        if self.proposal_cache is None:
+            return None
+        return self.proposal_cache.get(session.questions, session.answers)
+
+    def _cache_proposal(self, session: QuizSession):
+        """生成できた提案をキャッシュに追加（フォールバック提案は追加しない）"""
+        if self.proposal_cache is not None and session.proposal and session.proposal != FALLBACK_PROPOSAL:
+            self.proposal_cache.put(session.questions, session.answers, session.proposal)
 
-    def get_session_data(self):
+    def get_session_data(self, session: QuizSession):
         """現在のセッションデータを取得"""
         return {
-            "questions": self.questions.copy(),
-            "answers": self.answers.copy(),
-            "current_num": len(self.questions)
+            "questions": session.questions.copy(),
+            "answers": session.answers.copy(),
+            "current_num": len(session.questions),
+            "proposal": session.proposal
         }
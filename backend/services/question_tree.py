@@ -0,0 +1,128 @@
+import mmap
+import os
+import struct
+from typing import Optional
+
+from .prompts import ANSWER_CHOICES
+
+# 質問の出し方（"llm": 毎回生成、"tree": 事前にコンパイルした質問ツリーを使う）
+QUESTION_MODE = os.getenv("QUESTION_MODE", "llm")
+QUESTION_TREE_PATH = os.getenv("QUESTION_TREE_PATH", "./question_tree.bin")
+
+# ファイル形式（リトルエンディアン）
+#   ヘッダー: マジック(8) 全質問数(u16) 分岐数(u16) ノード数(u32) 文字列領域の位置(u32)
+#   ノード表: (文字列の位置(u32), バイト数(u32)) × ノード数（幅優先順、子は i * 分岐数 + 1 + 回答番号）
+#   文字列領域: UTF-8の質問文を連結したもの
+MAGIC = b"QTREE\x00\x00\x01"
+_HEADER = struct.Struct("<8sHHII")
+_NODE = struct.Struct("<II")
+
+
+def node_count(num_questions: int, branching: int = len(ANSWER_CHOICES)) -> int:
+    """深さnum_questionsの完全木のノード数"""
+    return sum(branching ** depth for depth in range(num_questions))
+
+
+def write_question_tree(path: str, num_questions: int, questions: list):
+    """幅優先順の質問リストを質問ツリーのファイルに書き出す"""
+    branching = len(ANSWER_CHOICES)
+    if len(questions) != node_count(num_questions, branching):
+        raise ValueError("質問の数がツリーのノード数と一致しません")
+
+    encoded = [question.encode("utf-8") for question in questions]
+    strings_offset = _HEADER.size + _NODE.size * len(encoded)
+    nodes = bytearray()
+    position = 0
+    for text in encoded:
+        nodes += _NODE.pack(position, len(text))
+        position += len(text)
+
+    # 読み込み中のワーカーに影響しないよう、別ファイルに書いてから置き換える
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, num_questions, branching, len(encoded), strings_offset))
+        f.write(nodes)
+        for text in encoded:
+            f.write(text)
+    os.replace(tmp_path, path)
+
+
+class QuestionTree:
+    """質問ツリーのファイルをmmapし、回答の並びでたどって質問を引く"""
+
+    def __init__(self, path: str = QUESTION_TREE_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.num_questions, self.branching, self.nodes, self._strings = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"質問ツリーのファイル形式が正しくありません: {path}")
+        if self.branching != len(ANSWER_CHOICES) or self.nodes != node_count(self.num_questions, self.branching):
+            raise ValueError(f"質問ツリーが現在の回答の選択肢と一致しません: {path}")
+        self._choices = {answer: index for index, answer in enumerate(ANSWER_CHOICES)}
+
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, answers: list, num_questions: int) -> Optional[str]:
+        """これまでの回答に続く質問を取得（ツリーの範囲外ならNone）"""
+        index = self._index(answers, num_questions)
+        if index is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        position, length = _NODE.unpack_from(self._map, _HEADER.size + _NODE.size * index)
+        start = self._strings + position
+        return self._map[start:start + length].decode("utf-8")
+
+    def _index(self, answers: list, num_questions: int) -> Optional[int]:
+        if num_questions != self.num_questions or len(answers) >= self.num_questions:
+            return None
+        index = 0
+        for answer in answers:
+            choice = self._choices.get(answer)
+            if choice is None:
+                return None
+            index = index * self.branching + 1 + choice
+        return index
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "num_questions": self.num_questions,
+            "nodes": self.nodes,
+            "bytes": len(self._map),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        self._map.close()
+
+
+_tree: Optional[QuestionTree] = None
+
+
+def get_question_tree() -> Optional[QuestionTree]:
+    """質問ツリーを取得（QUESTION_MODEがtreeでなければNone）"""
+    global _tree
+    if QUESTION_MODE != "tree":
+        return None
+    if _tree is None:
+        if not os.path.exists(QUESTION_TREE_PATH):
+            raise ValueError(
+                f"質問ツリーが見つかりません: {QUESTION_TREE_PATH}（build_question_tree.pyで作成してください）"
+            )
+        _tree = QuestionTree(QUESTION_TREE_PATH)
+    return _tree
+
+
+def close_question_tree():
+    """質問ツリーのmmapを解放"""
+    global _tree
+    if _tree is not None:
+        _tree.close()
+        _tree = None
@@ -0,0 +1,391 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+# セッションの保持設定（環境変数で上書き可能）
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory" または "sqlite"
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "./sessions.db")
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+
+
+class SessionConflict(Exception):
+    """読み込んだ後に別のリクエスト（別のワーカー）がセッションを更新していた"""
+
+
+class QuizSession:
+    """1ユーザー分のクイズの状態（サービスやクライアントは持たない）"""
+
+    __slots__ = (
+        "user_id", "version", "created_at", "questions", "answers", "proposal", "planned",
+        "prefetch_num", "prefetch_tasks", "history", "last_access",
+    )
+
+    def __init__(
+        self, user_id: int, version: int = 0, questions=None, answers=None, proposal=None, planned=None,
+        created_at: Optional[float] = None,
+    ):
+        self.user_id = user_id
+        self.version = version  # 保存のたびに1つ増える（楽観的排他制御用）
+        # 作成時刻（破棄後に作り直したセッションとバージョンが重なってもETagが変わるように）
+        self.created_at = created_at if created_at is not None else time.time()
+        self.questions = questions if questions is not None else []
+        self.answers = answers if answers is not None else []
+        self.proposal = proposal
+        self.planned = planned if planned is not None else []  # 一括生成した全質問（batchモード）
+        # 投機的な先読み（回答ごとの次の質問の生成タスク、プロセス内のみ）
+        self.prefetch_num = None
+        self.prefetch_tasks = {}
+        self.history = None  # プロンプト用に整形済みの履歴（PromptHistory、プロセス内のみ）
+        self.last_access = time.monotonic()
+
+    def approx_bytes(self) -> int:
+        """おおよそのメモリ使用量"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.questions) + sys.getsizeof(self.answers)
+        size += sum(sys.getsizeof(text) for text in self.questions)
+        size += sum(sys.getsizeof(text) for text in self.answers)
+        size += sum(sys.getsizeof(text) for text in self.planned)
+        if self.proposal is not None:
+            size += sys.getsizeof(self.proposal)
+        return size
+
+
+class SessionStore(ABC):
+    """クイズセッションの保存先のインターフェース"""
+
+    def __init__(
+        self,
+        on_evict: Optional[Callable[[QuizSession], None]] = None,
+        on_expire: Optional[Callable[[QuizSession, str], None]] = None,
+    ):
+        self.on_evict = on_evict  # プロセス内の状態を手放すとき（先読みの破棄など）
+        self.on_expire = on_expire  # 期限切れ（"expired"）や件数超過（"evicted"）でセッション自体を破棄したとき
+
+    @abstractmethod
+    async def load(self, user_id: int) -> QuizSession:
+        """ユーザーのセッションを取得（なければ作成）"""
+
+    @abstractmethod
+    async def save(self, session: QuizSession):
+        """セッションを保存（読み込み後に他で更新されていればSessionConflict）"""
+
+    @abstractmethod
+    async def delete(self, user_id: int):
+        """セッションを破棄"""
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        """件数などの統計を取得"""
+
+    def close(self):
+        """保存先を閉じる"""
+
+    def _evict(self, session: QuizSession):
+        if self.on_evict is not None:
+            self.on_evict(session)
+
+    def _expired(self, session: QuizSession, reason: str = "expired"):
+        if self.on_expire is not None:
+            self.on_expire(session, reason)
+
+
+class MemorySessionStore(SessionStore):
+    """プロセス内に保持するセッションストア（アイドル時間のTTLと最大件数のLRUで破棄）"""
+
+    def __init__(
+        self,
+        ttl: float = SESSION_TTL_SECONDS,
+        max_entries: int = SESSION_MAX_ENTRIES,
+        on_evict: Optional[Callable[[QuizSession], None]] = None,
+        on_expire: Optional[Callable[[QuizSession, str], None]] = None,
+    ):
+        super().__init__(on_evict, on_expire)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # 最後にアクセスした順（古いものが先頭）
+        self._sessions: "OrderedDict[int, QuizSession]" = OrderedDict()
+
+        self.expired = 0
+        self.evicted = 0
+
+    async def load(self, user_id: int) -> QuizSession:
+        return self.get(user_id)
+
+    def get(self, user_id: int) -> QuizSession:
+        now = time.monotonic()
+        self._expire(now)
+
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._sessions[user_id] = QuizSession(user_id)
+            while len(self._sessions) > self.max_entries:
+                _, oldest = self._sessions.popitem(last=False)
+                self.evicted += 1
+                self._evict(oldest)
+                self._expired(oldest, "evicted")
+        else:
+            self._sessions.move_to_end(user_id)
+        session.last_access = now
+        return session
+
+    async def save(self, session: QuizSession):
+        current = self._sessions.get(session.user_id)
+        if current is not None and current is not session:
+            raise SessionConflict("セッションが他のリクエストで更新されました")
+        session.version += 1
+        if current is None:
+            self._sessions[session.user_id] = session
+
+    async def delete(self, user_id: int):
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self._evict(session)
+
+    def _expire(self, now: float):
+        # 先頭から順にアイドル時間を超えたものだけを破棄する
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if now - session.last_access < self.ttl:
+                break
+            del self._sessions[user_id]
+            self.expired += 1
+            self._evict(session)
+            self._expired(session)
+
+    def close(self):
+        # プロセスの終了とともに失われるので、残っているセッションも破棄として扱う
+        while self._sessions:
+            _, session = self._sessions.popitem(last=False)
+            self._evict(session)
+            self._expired(session)
+
+    async def stats(self) -> dict:
+        self._expire(time.monotonic())
+        return {
+            "backend": "memory",
+            "entries": len(self._sessions),
+            "approx_bytes": sum(session.approx_bytes() for session in self._sessions.values()),
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite（WAL）に保存するセッションストア（同一ホストの複数ワーカーで共有できる）
+
+    読み込んだセッションはバージョンが一致する間だけプロセス内で再利用し、
+    保存時はバージョンが変わっていないことを条件に更新する。
+    """
+
+    def __init__(
+        self,
+        path: str = SESSION_DB_PATH,
+        ttl: float = SESSION_TTL_SECONDS,
+        max_entries: int = SESSION_MAX_ENTRIES,
+        on_evict: Optional[Callable[[QuizSession], None]] = None,
+        on_expire: Optional[Callable[[QuizSession, str], None]] = None,
+    ):
+        super().__init__(on_evict, on_expire)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local: "OrderedDict[int, QuizSession]" = OrderedDict()
+        self._saves_since_trim = 0
+
+        self.conflicts = 0
+        self.expired = 0
+        self.evicted = 0
+
+        # SQLiteへのアクセスは専用スレッド1本に直列化する
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-store")
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS quiz_sessions (
+                user_id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL,
+                questions TEXT NOT NULL,
+                answers TEXT NOT NULL,
+                proposal TEXT,
+                planned TEXT NOT NULL DEFAULT '[]',
+                created_at REAL NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(quiz_sessions)")}
+        if "planned" not in columns:
+            self._conn.execute("ALTER TABLE quiz_sessions ADD COLUMN planned TEXT NOT NULL DEFAULT '[]'")
+        if "created_at" not in columns:
+            self._conn.execute("ALTER TABLE quiz_sessions ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_quiz_sessions_updated ON quiz_sessions (updated_at)")
+        self._conn.commit()
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def load(self, user_id: int) -> QuizSession:
+        row, expired = await self._run(self._select, user_id)
+        self._expire_rows(expired)
+        cached = self._local.get(user_id)
+
+        if row is None:
+            # 未保存のセッションは読み込みのたびに作るので、作成時刻は最初の保存時に決める
+            session = QuizSession(user_id, created_at=0.0)
+        elif cached is not None and cached.version == row[0]:
+            # 他のワーカーが更新していなければ先読みタスクごと再利用する
+            session = cached
+        else:
+            session = self._to_session(user_id, *row)
+
+        if cached is not None and cached is not session:
+            self._evict(cached)
+        self._remember(session)
+        return session
+
+    async def save(self, session: QuizSession):
+        if session.version == 0:
+            session.created_at = time.time()
+        saved, expired = await self._run(self._write, session.user_id, session.version, session.created_at,
+                                         session.questions.copy(), session.answers.copy(), session.proposal,
+                                         session.planned.copy())
+        self._expire_rows(expired)
+        if not saved:
+            self.conflicts += 1
+            self._forget(session.user_id)
+            raise SessionConflict("セッションが他のリクエストで更新されました")
+        session.version += 1
+        self._remember(session)
+
+    async def delete(self, user_id: int):
+        await self._run(self._remove, user_id)
+        self._forget(user_id)
+
+    def _remember(self, session: QuizSession):
+        session.last_access = time.monotonic()
+        self._local[session.user_id] = session
+        self._local.move_to_end(session.user_id)
+        while len(self._local) > self.max_entries:
+            _, oldest = self._local.popitem(last=False)
+            self._evict(oldest)
+
+    def _forget(self, user_id: int):
+        session = self._local.pop(user_id, None)
+        if session is not None:
+            self._evict(session)
+
+    def _expire_rows(self, rows: list):
+        """削除した行をセッションに戻して通知する"""
+        for (user_id, version, *columns), reason in rows:
+            if reason == "evicted":
+                self.evicted += 1
+            else:
+                self.expired += 1
+            cached = self._local.get(user_id)
+            if cached is not None and cached.version == version:
+                self._forget(user_id)
+            self._expired(self._to_session(user_id, version, *columns), reason)
+
+    @staticmethod
+    def _to_session(
+        user_id: int, version: int, questions: str, answers: str, proposal, planned: str, created_at: float
+    ) -> QuizSession:
+        return QuizSession(
+            user_id, version, json.loads(questions), json.loads(answers), proposal, json.loads(planned), created_at
+        )
+
+    def _select(self, user_id: int):
+        row = self._conn.execute(
+            """SELECT user_id, version, questions, answers, proposal, planned, created_at, updated_at
+            FROM quiz_sessions WHERE user_id = ?""",
+            (user_id,),
+        ).fetchone()
+        if row is None:
+            return None, []
+        if time.time() - row[7] >= self.ttl:
+            cursor = self._conn.execute("DELETE FROM quiz_sessions WHERE user_id = ? AND version = ?", (user_id, row[1]))
+            self._conn.commit()
+            return None, [(row[:7], "expired")] if cursor.rowcount == 1 else []
+        return row[1:7], []
+
+    def _write(
+        self, user_id: int, version: int, created_at: float, questions: list, answers: list, proposal, planned: list
+    ) -> tuple:
+        now = time.time()
+        params = (
+            json.dumps(questions, ensure_ascii=False),
+            json.dumps(answers, ensure_ascii=False),
+            proposal,
+            json.dumps(planned, ensure_ascii=False),
+            now,
+        )
+        if version == 0:
+            cursor = self._conn.execute(
+                """INSERT INTO quiz_sessions (user_id, version, created_at, questions, answers, proposal, planned, updated_at)
+                VALUES (?, 1, ?, ?, ?, ?, ?, ?) ON CONFLICT (user_id) DO NOTHING""",
+                (user_id, created_at, *params),
+            )
+        else:
+            cursor = self._conn.execute(
+                """UPDATE quiz_sessions SET version = version + 1, questions = ?, answers = ?, proposal = ?, planned = ?,
+                updated_at = ? WHERE user_id = ? AND version = ?""",
+                (*params, user_id, version),
+            )
+        saved = cursor.rowcount == 1
+
+        # 期限切れと件数超過の削除は一定間隔でまとめて行う
+        expired = []
+        self._saves_since_trim += 1
+        if self._saves_since_trim >= 100:
+            self._saves_since_trim = 0
+            rows = self._conn.execute(
+                """DELETE FROM quiz_sessions WHERE updated_at <= ? OR user_id IN (
+                    SELECT user_id FROM quiz_sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?
+                ) RETURNING user_id, version, questions, answers, proposal, planned, created_at, updated_at""",
+                (now - self.ttl, self.max_entries),
+            ).fetchall()
+            # 期限内の行は件数超過で削除したもの
+            expired = [(row[:7], "expired" if row[7] <= now - self.ttl else "evicted") for row in rows]
+        self._conn.commit()
+        return saved, expired
+
+    def _remove(self, user_id: int):
+        self._conn.execute("DELETE FROM quiz_sessions WHERE user_id = ?", (user_id,))
+        self._conn.commit()
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM quiz_sessions").fetchone()[0]
+
+    async def stats(self) -> dict:
+        return {
+            "backend": "sqlite",
+            "entries": await self._run(self._count),
+            "local_entries": len(self._local),
+            "approx_bytes": sum(session.approx_bytes() for session in self._local.values()),
+            "conflicts": self.conflicts,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._conn.close()
+
+
+def create_session_store(
+    on_evict: Optional[Callable[[QuizSession], None]] = None,
+    on_expire: Optional[Callable[[QuizSession, str], None]] = None,
+) -> SessionStore:
+    """SESSION_BACKENDに応じたセッションストアを作成"""
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore(on_evict=on_evict, on_expire=on_expire)
+    if SESSION_BACKEND == "memory":
+        return MemorySessionStore(on_evict=on_evict, on_expire=on_expire)
+    raise ValueError(f"SESSION_BACKENDの値が正しくありません: {SESSION_BACKEND}")
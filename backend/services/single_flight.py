@@ -0,0 +1,47 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """同じキーの同時呼び出しを1回の実行にまとめる"""
+
+    def __init__(self):
+        # キー -> [実行中のタスク, 待っている呼び出し元の数]
+        self._calls = {}
+        self.executed = 0
+        self.saved = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        """実行中の同じキーの呼び出しがあればその結果を共有し、なければfnを実行"""
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            call = [task, 0]
+            self._calls[key] = call
+            task.add_done_callback(lambda _: self._forget(key, call))
+            self.executed += 1
+        else:
+            self.saved += 1
+
+        call[1] += 1
+        try:
+            # 呼び出し元がキャンセルされても共有中の実行は止めない
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            # 全員が切断した場合だけ実行をキャンセルする
+            if call[1] == 0 and not call[0].done():
+                call[0].cancel()
+                self._forget(key, call)
+
+    def _forget(self, key: Hashable, call: list):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        """まとめた呼び出しの統計を取得"""
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "saved": self.saved,
+        }
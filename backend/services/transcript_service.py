@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+
+from database import AsyncSessionLocal
+from models.database_models import QuizSessionRecord, QuizTurn, QuizProposal
+from .session_store import QuizSession
+
+# 終了したクイズの書き出し設定（環境変数で上書き可能）
+TRANSCRIPT_ENABLED = os.getenv("TRANSCRIPT_ENABLED", "true").lower() in ("1", "true", "yes")
+TRANSCRIPT_BATCH_SIZE = int(os.getenv("TRANSCRIPT_BATCH_SIZE", "100"))
+TRANSCRIPT_FLUSH_SECONDS = float(os.getenv("TRANSCRIPT_FLUSH_SECONDS", "5"))
+TRANSCRIPT_MAX_BUFFER = int(os.getenv("TRANSCRIPT_MAX_BUFFER", "10000"))
+
+logger = logging.getLogger(__name__)
+
+
+class _Transcript:
+    __slots__ = ("id", "user_id", "reason", "questions", "answers", "proposal", "ended_at")
+
+    def __init__(self, session: QuizSession, reason: str):
+        self.id = uuid.uuid4().hex
+        self.user_id = session.user_id
+        self.reason = reason
+        self.questions = session.questions.copy()
+        self.answers = session.answers.copy()
+        self.proposal = session.proposal
+        self.ended_at = datetime.now(timezone.utc)
+
+
+class TranscriptWriter:
+    """終了したクイズの質問・回答・提案をためておき、まとめてSQLiteへ書き出す"""
+
+    def __init__(
+        self,
+        enabled: bool = TRANSCRIPT_ENABLED,
+        batch_size: int = TRANSCRIPT_BATCH_SIZE,
+        flush_interval: float = TRANSCRIPT_FLUSH_SECONDS,
+        max_buffer: int = TRANSCRIPT_MAX_BUFFER,
+    ):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+
+        self._buffer = deque()
+        self._full = asyncio.Event()
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def record(self, session: QuizSession, reason: str):
+        """終了したセッションを書き出し待ちに追加（上限を超えた分は破棄）"""
+        if not self.enabled or not session.questions:
+            return
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        self._buffer.append(_Transcript(session, reason))
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+
+    async def flush(self):
+        """書き出し待ちをバッチごとに1トランザクションで書き出す"""
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                await self._write(batch)
+            except (Exception, asyncio.CancelledError):
+                # 書き出せなかった分（停止時のキャンセルを含む）は先頭に戻す（上限を超える分は破棄）
+                room = self.max_buffer - len(self._buffer)
+                self.dropped += max(0, len(batch) - room)
+                self._buffer.extendleft(reversed(batch[:max(0, room)]))
+                raise
+            self.written += len(batch)
+            self.batches += 1
+
+    async def _write(self, batch: list):
+        records, turns, proposals = [], [], []
+        for transcript in batch:
+            records.append({
+                "id": transcript.id,
+                "user_id": transcript.user_id,
+                "reason": transcript.reason,
+                "num_turns": len(transcript.questions),
+                "ended_at": transcript.ended_at,
+            })
+            for turn, question in enumerate(transcript.questions):
+                answer = transcript.answers[turn] if turn < len(transcript.answers) else None
+                turns.append({"session_id": transcript.id, "turn": turn, "question": question, "answer": answer})
+            if transcript.proposal:
+                proposals.append({
+                    "session_id": transcript.id,
+                    "user_id": transcript.user_id,
+                    "proposal": transcript.proposal,
+                    "created_at": transcript.ended_at,
+                })
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(QuizSessionRecord), records)
+            if turns:
+                await db.execute(insert(QuizTurn), turns)
+            if proposals:
+                await db.execute(insert(QuizProposal), proposals)
+            await db.commit()
+
+    async def run(self):
+        """件数か時間のどちらかに達したら書き出すループ"""
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("クイズ履歴の書き出しに失敗しました")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+        }
+
+
+transcript_writer = TranscriptWriter()
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+import time
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql import func
+
+from database import AsyncSessionLocal, engine
+from models.database_models import LLMUsage
+from .prompts import estimate_tokens
+
+# ユーザーごとの生成回数の上限（トークンバケット、環境変数で上書き可能）
+QUOTA_QUESTION_PER_MINUTE = float(os.getenv("QUOTA_QUESTION_PER_MINUTE", "20"))
+QUOTA_QUESTION_BURST = int(os.getenv("QUOTA_QUESTION_BURST", "10"))
+QUOTA_PROPOSAL_PER_MINUTE = float(os.getenv("QUOTA_PROPOSAL_PER_MINUTE", "2"))
+QUOTA_PROPOSAL_BURST = int(os.getenv("QUOTA_PROPOSAL_BURST", "3"))
+
+# 利用量をデータベースへ書き出す間隔
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class QuotaLimiter:
+    """ユーザーごとのトークンバケットによる回数制限"""
+
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self._buckets = {}
+        self._calls_since_prune = 0
+        self.rejected = 0
+
+    def retry_after(self, user_id: int) -> float:
+        """残りがあるか確認する（あれば0、なければ再試行までの秒数。消費はしない）"""
+        bucket = self._bucket(user_id)
+        if bucket.tokens >= 1:
+            return 0.0
+        self.rejected += 1
+        return (1 - bucket.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def remaining(self, user_id: int) -> float:
+        """残りの回数を取得（消費はしない）"""
+        return self._bucket(user_id).tokens
+
+    def consume(self, user_id: int):
+        """実際に生成したときに1回分を消費する
+
+        確認から生成までの間に同時に通った分は負になり、その分だけ次の確認で長く待たせる。
+        """
+        self._bucket(user_id).tokens -= 1
+
+    def _bucket(self, user_id: int) -> _Bucket:
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(self.burst, now)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+        self._calls_since_prune += 1
+        if self._calls_since_prune >= 1000:
+            self._prune(now)
+            self._buckets[user_id] = bucket
+        return bucket
+
+    def _prune(self, now: float):
+        """満タンに戻ったバケットは破棄する（次回は新規作成と同じ）"""
+        self._calls_since_prune = 0
+        if self.rate <= 0:
+            return
+        self._buckets = {
+            user_id: bucket for user_id, bucket in self._buckets.items()
+            if now - bucket.updated < (self.burst - bucket.tokens) / self.rate
+        }
+
+    def stats(self) -> dict:
+        return {"tracked_users": len(self._buckets), "rejected": self.rejected}
+
+
+class _Usage:
+    __slots__ = ("calls", "prompt_chars", "response_chars", "prompt_tokens", "response_tokens", "latency_ms")
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_chars = 0
+        self.response_chars = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.latency_ms = 0.0
+
+
+# 利用量の加算に使うUPSERT（ON CONFLICT DO UPDATE）に対応したデータベースのinsert
+UPSERT_INSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+class UsageMeter:
+    """ユーザーごとのLLM利用量をメモリで集計し、定期的にデータベースへ加算する"""
+
+    def __init__(self, dialect: str = engine.dialect.name):
+        if dialect not in UPSERT_INSERTS:
+            # 起動時に分かるように、対応していないデータベースではここで止める
+            raise ValueError(f"LLM利用量の記録は{dialect}に対応していません（対応: {', '.join(UPSERT_INSERTS)}）")
+        self._insert = UPSERT_INSERTS[dialect]
+        # (ユーザーID, 種類) -> _Usage（未書き出しの差分）
+        self._pending = {}
+        self.flushed_rows = 0
+
+    def record(self, user_id, kind: str, prompt: str, response: str, latency: float):
+        """1回分の利用量を記録"""
+        if user_id is None:
+            return
+        usage = self._pending.get((user_id, kind))
+        if usage is None:
+            usage = self._pending[(user_id, kind)] = _Usage()
+        usage.calls += 1
+        usage.prompt_chars += len(prompt)
+        usage.response_chars += len(response)
+        usage.prompt_tokens += estimate_tokens(prompt)
+        usage.response_tokens += estimate_tokens(response)
+        usage.latency_ms += latency * 1000
+
+    async def flush(self):
+        """未書き出しの利用量をデータベースに加算"""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                for (user_id, kind), usage in pending.items():
+                    values = {name: getattr(usage, name) for name in _Usage.__slots__}
+                    stmt = self._insert(LLMUsage).values(user_id=user_id, kind=kind, **values)
+                    updates = {name: getattr(LLMUsage, name) + getattr(stmt.excluded, name) for name in values}
+                    updates["updated_at"] = func.now()
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[LLMUsage.user_id, LLMUsage.kind],
+                        set_=updates,
+                    )
+                    await db.execute(stmt)
+                await db.commit()
+            self.flushed_rows += len(pending)
+        except (Exception, asyncio.CancelledError):
+            # 書き出しに失敗した分（停止時のキャンセルを含む）は次回に持ち越す
+            for key, usage in pending.items():
+                current = self._pending.setdefault(key, _Usage())
+                for name in _Usage.__slots__:
+                    setattr(current, name, getattr(current, name) + getattr(usage, name))
+            raise
+
+    async def run(self, interval: float = USAGE_FLUSH_SECONDS):
+        """定期的に書き出すループ"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("利用量の書き出しに失敗しました")
+
+    def stats(self) -> dict:
+        return {"pending_rows": len(self._pending), "flushed_rows": self.flushed_rows}
+
+
+usage_meter = UsageMeter()
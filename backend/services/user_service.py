@@ -1,13 +1,60 @@
+import json
+import os
+from typing import AsyncIterator, Optional
+
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import insert, select, update
+from database import AsyncSessionLocal
 from models.database_models import User
-from models.schemas import UserCreate, UserResponse
-from .auth_service import get_password_hash
+from models.schemas import (
+    UserCreate, UserResponse, UserBulkUpdate, UserBulkDeactivate, BulkRowError, BulkUserResult
+)
+from .password_hasher import password_hasher
+from .principal_cache import principal_cache
+
+# 一覧の1ページの最大件数と、エクスポートで1度に読み込む件数（環境変数で上書き可能）
+USER_PAGE_MAX_LIMIT = int(os.getenv("USER_PAGE_MAX_LIMIT", "1000"))
+USER_EXPORT_CHUNK_SIZE = int(os.getenv("USER_EXPORT_CHUNK_SIZE", "500"))
+# 一括処理の1文で扱う件数（SQLiteの変数の上限に収まるように分ける）
+USER_BULK_CHUNK_SIZE = int(os.getenv("USER_BULK_CHUNK_SIZE", "500"))
+
+# 一覧とエクスポートで返す列（ORMオブジェクトを作らずに行として読む）
+USER_COLUMNS = (User.id, User.email, User.full_name, User.created_at, User.is_active)
+
+
+def _json_default(value):
+    return value.isoformat()
+
+
+def _chunks(items: list, size: int = USER_BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _validate_rows(rows: list, schema: type, errors: list) -> list:
+    """(入力の位置, 値) の並びをスキーマで検証し、通ったものを (位置, モデル) で返す"""
+    valid = []
+    for index, raw in rows:
+        try:
+            valid.append((index, schema.model_validate(raw)))
+        except ValidationError as e:
+            detail = "; ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" if err["loc"] else err["msg"] for err in e.errors()
+            )
+            errors.append(BulkRowError(index=index, detail=detail))
+    return valid
+
+
+def _bulk_result(succeeded: int, errors: list) -> BulkUserResult:
+    errors.sort(key=lambda error: error.index)
+    return BulkUserResult(succeeded=succeeded, failed=len(errors), errors=errors)
+
 
 class UserService:
     async def create_user(self, db: AsyncSession, user: UserCreate) -> UserResponse:
         """ユーザーを作成"""
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await password_hasher.hash(user.password)
         db_user = User(
             email=user.email,
             hashed_password=hashed_password,
@@ -21,34 +68,37 @@ class UserService:
             id=db_user.id,
             email=db_user.email,
             full_name=db_user.full_name,
+            created_at=db_user.created_at,
             is_active=db_user.is_active
         )
     
-    async def get_users(self, db: AsyncSession, skip: int = 0, limit: int = 100):
-        """ユーザー一覧を取得"""
-        result = await db.execute(select(User).offset(skip).limit(limit))
-        users = result.scalars().all()
-        return [
-            UserResponse(
-                id=user.id,
-                email=user.email,
-                full_name=user.full_name,
-                is_active=user.is_active
-            ) for user in users
-        ]
+    async def get_users(self, db: AsyncSession, after: Optional[int] = None, limit: int = 100):
+        """ユーザー一覧をIDの昇順で取得（afterを渡した場合はそのIDより後から）"""
+        query = select(*USER_COLUMNS).order_by(User.id).limit(limit)
+        if after is not None:
+            query = query.where(User.id > after)
+        result = await db.execute(query)
+        return result.all()
+    
+    async def export_users(self, chunk_size: int = USER_EXPORT_CHUNK_SIZE) -> AsyncIterator[str]:
+        """全ユーザーをNDJSONで少しずつ出力
+        
+        サーバー側カーソルでchunk_size件ずつ読み、送信が済んでから次を読む。
+        レスポンスの送信中も使うので、リクエストのセッションではなく専用のセッションを開く。
+        """
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(
+                select(*USER_COLUMNS).order_by(User.id).execution_options(yield_per=chunk_size)
+            )
+            async for rows in result.partitions():
+                yield "".join(
+                    json.dumps(row._asdict(), ensure_ascii=False, default=_json_default) + "\n" for row in rows
+                )
     
     async def get_user(self, db: AsyncSession, user_id: int):
-        """特定のユーザーを取得"""
-        result = await db.execute(select(User).where(User.id == user_id))
-        user = result.scalar_one_or_none()
-        if user is None:
-            return None
-        return UserResponse(
-            id=user.id,
-            email=user.email,
-            full_name=user.full_name,
-            is_active=user.is_active
-        )
+        """特定のユーザーを取得（ETag用にversionを含む行として返す）"""
+        result = await db.execute(select(*USER_COLUMNS, User.version).where(User.id == user_id))
+        return result.one_or_none()
     
     async def get_user_by_email(self, db: AsyncSession, email: str):
         """メールアドレスでユーザーを取得"""
@@ -63,15 +113,22 @@ class UserService:
             return None
         
         update_data = user_update.dict(exclude_unset=True)
+        password = update_data.pop("password", None)
+        if password is not None:
+            update_data["hashed_password"] = await password_hasher.hash(password)
+        old_email = db_user.email
         for field, value in update_data.items():
             setattr(db_user, field, value)
         
         await db.commit()
+        # 認証済みユーザーのキャッシュから更新前後のメールアドレスを破棄
+        principal_cache.invalidate(old_email, db_user.email)
         await db.refresh(db_user)
         return UserResponse(
             id=db_user.id,
             email=db_user.email,
             full_name=db_user.full_name,
+            created_at=db_user.created_at,
             is_active=db_user.is_active
         )
     
@@ -84,4 +141,115 @@ class UserService:
         
         await db.delete(db_user)
         await db.commit()
+        principal_cache.invalidate(db_user.email)
         return True
+    
+    async def _load_users(self, db: AsyncSession, ids: list) -> dict:
+        """IDごとのメールアドレスを取得（存在するものだけ）"""
+        emails = {}
+        for chunk in _chunks(ids):
+            result = await db.execute(select(User.id, User.email).where(User.id.in_(chunk)))
+            emails.update(result.all())
+        return emails
+    
+    async def _taken_emails(self, db: AsyncSession, emails: list) -> dict:
+        """使用済みのメールアドレスと、そのユーザーIDを取得"""
+        taken = {}
+        for chunk in _chunks(emails):
+            result = await db.execute(select(User.email, User.id).where(User.email.in_(chunk)))
+            taken.update(result.all())
+        return taken
+    
+    async def import_users(self, db: AsyncSession, rows: list, errors: list) -> BulkUserResult:
+        """ユーザーを一括作成（rowsは (入力の位置, 値) の並び）
+        
+        問題のある行はerrorsに追加して飛ばし、残りを1トランザクションでまとめて挿入する。
+        """
+        users = []
+        seen = set()
+        candidates = _validate_rows(rows, UserCreate, errors)
+        taken = await self._taken_emails(db, [user.email for _, user in candidates])
+        for index, user in candidates:
+            if user.email in taken or user.email in seen:
+                errors.append(BulkRowError(index=index, detail="このメールアドレスは既に使用されています"))
+                continue
+            seen.add(user.email)
+            users.append(user)
+        
+        # パスワードのハッシュ化はプロセスプールの全ワーカーで並列に行う
+        hashed = await password_hasher.hash_many([user.password for user in users])
+        values = [
+            {"email": user.email, "hashed_password": hashed_password, "full_name": user.full_name, "is_active": True}
+            for user, hashed_password in zip(users, hashed)
+        ]
+        for chunk in _chunks(values):
+            await db.execute(insert(User), chunk)
+        await db.commit()
+        return _bulk_result(len(values), errors)
+    
+    async def update_users(self, db: AsyncSession, rows: list, errors: list) -> BulkUserResult:
+        """ユーザーを一括更新（rowsは (入力の位置, 値) の並び）
+        
+        存在しないIDやメールアドレスの重複がある行はerrorsに追加して飛ばし、残りを1トランザクションで更新する。
+        """
+        candidates = _validate_rows(rows, UserBulkUpdate, errors)
+        current = await self._load_users(db, [user.id for _, user in candidates])
+        taken = await self._taken_emails(db, [user.email for _, user in candidates if user.email is not None])
+        
+        updates = []
+        seen_ids = set()
+        seen_emails = set()
+        for index, user in candidates:
+            if user.id not in current:
+                errors.append(BulkRowError(index=index, detail="ユーザーが見つかりません"))
+                continue
+            if user.id in seen_ids:
+                errors.append(BulkRowError(index=index, detail="同じユーザーが複数回指定されています"))
+                continue
+            if user.email is not None and (taken.get(user.email, user.id) != user.id or user.email in seen_emails):
+                errors.append(BulkRowError(index=index, detail="このメールアドレスは既に使用されています"))
+                continue
+            seen_ids.add(user.id)
+            if user.email is not None:
+                seen_emails.add(user.email)
+            updates.append(user.model_dump(exclude_unset=True, exclude_none=True))
+        
+        with_password = [values for values in updates if "password" in values]
+        hashed = await password_hasher.hash_many([values["password"] for values in with_password])
+        for values, hashed_password in zip(with_password, hashed):
+            values["hashed_password"] = hashed_password
+        for values in with_password:
+            del values["password"]
+        
+        # 主キーを含む辞書の並びを渡すと、列の組み合わせごとにexecutemanyで更新される
+        changes = [values for values in updates if len(values) > 1]
+        for chunk in _chunks(changes):
+            await db.execute(update(User), chunk)
+        await db.commit()
+        
+        # 認証済みユーザーのキャッシュから更新前後のメールアドレスを破棄
+        emails = [current[values["id"]] for values in updates]
+        emails += [values["email"] for values in updates if "email" in values]
+        if emails:
+            principal_cache.invalidate(*emails)
+        return _bulk_result(len(updates), errors)
+    
+    async def deactivate_users(self, db: AsyncSession, rows: list, errors: list) -> BulkUserResult:
+        """ユーザーを一括で非アクティブにする（rowsは (入力の位置, 値) の並び）"""
+        candidates = _validate_rows(rows, UserBulkDeactivate, errors)
+        current = await self._load_users(db, [user.id for _, user in candidates])
+        
+        ids = set()
+        for index, user in candidates:
+            if user.id not in current:
+                errors.append(BulkRowError(index=index, detail="ユーザーが見つかりません"))
+                continue
+            ids.add(user.id)
+        
+        for chunk in _chunks(sorted(ids)):
+            await db.execute(update(User).where(User.id.in_(chunk)).values(is_active=False))
+        await db.commit()
+        
+        if ids:
+            principal_cache.invalidate(*(current[user_id] for user_id in ids))
+        return _bulk_result(len(ids), errors)
@@ -0,0 +1,80 @@
+import os
+import tempfile
+from types import SimpleNamespace
+
+# アプリを読み込む前に、テスト用の設定にする（相対パスのデータベースやキャッシュは一時ディレクトリに作る）
+os.chdir(tempfile.mkdtemp(prefix="hackathon-test-"))
+os.environ.setdefault("DATABASE_ECHO", "false")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("QUESTION_POOL_ENABLED", "false")
+os.environ.setdefault("TRANSCRIPT_ENABLED", "false")
+
+import httpx
+import pytest
+
+from database import init_db
+from main_mvc import app
+from services.auth_service import create_access_token
+from services.llm_gateway import get_llm_gateway
+from services.password_hasher import password_hasher
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def fake_hasher(monkeypatch):
+    """bcryptのプロセスプールの代わりに、同じ非同期インターフェースの軽いハッシュを使う"""
+    async def hash(password):
+        return "fake$" + password
+
+    async def hash_many(passwords):
+        return ["fake$" + password for password in passwords]
+
+    async def verify(plain_password, hashed_password):
+        return hashed_password == "fake$" + plain_password
+
+    monkeypatch.setattr(password_hasher, "hash", hash)
+    monkeypatch.setattr(password_hasher, "hash_many", hash_many)
+    monkeypatch.setattr(password_hasher, "verify", verify)
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """Geminiを呼ばずに、プロンプトに応じた固定の応答を返す（ストリーミングは2つのチャンクに分けて返す）"""
+    calls = []
+
+    def reply(prompt):
+        calls.append(prompt)
+        if "提案" in prompt and "アドバイザー" in prompt:
+            return "毎日10分の読書から始めましょう。応援しています！"
+        return "毎日決まった時間に運動をしていますか？"
+
+    def generate(prompt, model, json_mode=False):
+        return reply(prompt)
+
+    def generate_content_stream(model, contents):
+        text = reply(contents)
+        half = len(text) // 2
+        return iter([SimpleNamespace(text=text[:half]), SimpleNamespace(text=text[half:])])
+
+    gateway = get_llm_gateway()
+    monkeypatch.setattr(gateway, "_generate_sync", generate)
+    monkeypatch.setattr(gateway.models, "generate_content_stream", generate_content_stream)
+    return calls
+
+
+@pytest.fixture
+async def client():
+    await init_db()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def auth_headers(email: str) -> dict:
+    return {"Authorization": "Bearer " + create_access_token({"sub": email})}
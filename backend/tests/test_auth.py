@@ -0,0 +1,57 @@
+import pytest
+from sqlalchemy import update
+
+from database import AsyncSessionLocal
+from models import User
+from tests.conftest import auth_headers
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_register_and_login(client, fake_hasher):
+    response = await client.post(
+        "/api/auth/register/json",
+        json={"email": "register@example.com", "password": "secret", "full_name": "山田"},
+    )
+    assert response.status_code == 201
+    assert response.json()["email"] == "register@example.com"
+
+    response = await client.post(
+        "/api/auth/login/json", json={"email": "register@example.com", "password": "secret"}
+    )
+    assert response.status_code == 200
+    token = response.json()["access_token"]
+
+    response = await client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+    assert response.json()["full_name"] == "山田"
+
+
+async def test_register_form_rejects_duplicate_email(client, fake_hasher):
+    data = {"email": "form@example.com", "password": "secret"}
+    assert (await client.post("/api/auth/register", data=data)).status_code == 201
+    assert (await client.post("/api/auth/register", data=data)).status_code == 400
+
+
+async def test_login_with_wrong_password(client, fake_hasher):
+    await client.post("/api/auth/register/json", json={"email": "wrong@example.com", "password": "secret"})
+    response = await client.post("/api/auth/login/json", json={"email": "wrong@example.com", "password": "nope"})
+    assert response.status_code == 401
+
+
+async def test_me_etag_reflects_updates_from_other_workers(client, fake_hasher):
+    await client.post("/api/auth/register/json", json={"email": "etag@example.com", "password": "secret", "full_name": "前"})
+    headers = auth_headers("etag@example.com")
+    response = await client.get("/api/auth/me", headers=headers)
+    etag = response.headers["ETag"]
+    assert (await client.get("/api/auth/me", headers={**headers, "If-None-Match": etag})).status_code == 304
+
+    # 他のワーカーでの更新（このプロセスの認証情報のキャッシュは破棄されない）
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(User).where(User.email == "etag@example.com").values(full_name="後"))
+        await db.commit()
+
+    response = await client.get("/api/auth/me", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["full_name"] == "後"
+    assert response.headers["ETag"] != etag
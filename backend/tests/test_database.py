@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from database import SQLITE_PRAGMAS, _add_missing_columns, describe_engine
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_sqlite_pragmas_are_applied_to_connections(client):
+    report = await describe_engine()
+    assert report["pool"] == "AsyncAdaptedQueuePool"
+    # 設定した値ではなく、接続から読み戻した値
+    assert report["journal_mode"] == "wal"
+    assert report["busy_timeout"] == SQLITE_PRAGMAS["busy_timeout"]
+    assert report["cache_size"] == SQLITE_PRAGMAS["cache_size"]
+
+
+def test_version_column_is_added_to_existing_users_table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR NOT NULL)"))
+        conn.execute(text("INSERT INTO users (email) VALUES ('old@example.com')"))
+
+    # 2回目は何もしない
+    for _ in range(2):
+        with engine.begin() as conn:
+            _add_missing_columns(conn)
+
+    with engine.connect() as conn:
+        assert "version" in {column["name"] for column in inspect(conn).get_columns("users")}
+        assert conn.execute(text("SELECT version FROM users")).scalar() == 0
+    engine.dispose()
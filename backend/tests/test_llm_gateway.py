@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+import pytest
+
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services.llm_cache import LLMCache
+from services.llm_gateway import LLMGateway
+from services.prompts import fallback_question
+from services.question_service import QuestionService
+from services.session_store import QuizSession
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def gateway(tmp_path):
+    gateway = LLMGateway(
+        api_key="test",
+        cache=LLMCache(path=str(tmp_path / "llm_cache.db")),
+        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60),
+    )
+    gateway.calls = []
+
+    def generate(prompt, model, json_mode=False):
+        gateway.calls.append(prompt)
+        time.sleep(0.05)
+        return f"{prompt}への応答"
+
+    gateway._generate_sync = generate
+    yield gateway
+    gateway.close()
+
+
+async def test_identical_calls_share_one_request_and_then_hit_the_cache(gateway, tmp_path):
+    results = await asyncio.gather(*(gateway.generate("質問") for _ in range(3)))
+    assert results == ["質問への応答"] * 3
+    assert gateway.calls == ["質問"]
+    assert gateway.single_flight.stats()["saved"] == 2
+
+    assert await gateway.generate("質問") == "質問への応答"
+    assert gateway.calls == ["質問"]
+    assert gateway.cache.memory_hits == 1
+
+    # use_cache=Falseは毎回呼び出す
+    await gateway.generate("質問", use_cache=False)
+    assert gateway.calls == ["質問", "質問"]
+
+    # ディスクの層は別のインスタンス（再起動後や他のワーカー）からも読める
+    gateway.cache._executor.submit(lambda: None).result()
+    other = LLMCache(path=str(tmp_path / "llm_cache.db"))
+    try:
+        assert await other.get("質問", gateway.model) == "質問への応答"
+        assert other.disk_hits == 1
+    finally:
+        other.close()
+
+
+async def test_breaker_opens_after_failures_and_questions_fall_back(gateway):
+    def fail(prompt, model, json_mode=False):
+        gateway.calls.append(prompt)
+        raise RuntimeError("Geminiの障害")
+
+    gateway._generate_sync = fail
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await gateway.generate("質問", use_cache=False)
+    assert gateway.breaker.state == CircuitBreaker.OPEN
+
+    # 開いている間はGeminiを呼ばずにすぐ失敗する
+    with pytest.raises(CircuitOpenError):
+        await gateway.generate("質問", use_cache=False)
+    assert len(gateway.calls) == 2
+
+    # 質問の生成はフォールバックの質問に切り替わる
+    service = QuestionService()
+    service.llm, service.pool, service.tree = gateway, None, None
+    question = await service.get_question(QuizSession(1), current_num=0)
+    assert question == fallback_question(0)
+    assert len(gateway.calls) == 2
@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+
+from services.admission import AdmissionController
+from services.question_service import QuestionService, prefetch_metrics
+from services.session_store import QuizSession
+
+pytestmark = pytest.mark.anyio
+
+
+def make_service(max_concurrency: int) -> QuestionService:
+    service = QuestionService(prefetch=True, admission=AdmissionController(max_concurrency=max_concurrency))
+    service.pool = None
+    service.tree = None
+    return service
+
+
+async def test_prefetch_uses_free_admission_slots_only(fake_llm):
+    service = make_service(max_concurrency=2)
+    session = QuizSession(1, questions=["毎日決まった時間に運動をしていますか？"])
+    skipped = prefetch_metrics.skipped
+
+    service._start_prefetch(session, 1, 5)
+    assert len(session.prefetch_tasks) == 2
+    assert service.admission.active == 2
+    assert prefetch_metrics.skipped == skipped + 1
+
+    # 取り消した先読みも実行枠を返す
+    tasks = list(session.prefetch_tasks.values())
+    service.discard_prefetch(session)
+    await asyncio.wait(tasks)
+    await asyncio.sleep(0)
+    assert service.admission.active == 0
+
+
+async def test_prefetch_keeps_quota_for_the_next_request(fake_llm):
+    service = make_service(max_concurrency=10)
+    session = QuizSession(2, questions=["毎日決まった時間に運動をしていますか？"])
+    quota = service.quotas["question"]
+    for _ in range(quota.burst - 1):
+        quota.consume(session.user_id)
+
+    service._start_prefetch(session, 1, 5)
+    assert session.prefetch_tasks == {}
+    assert service.admission.active == 0
@@ -0,0 +1,22 @@
+from services.principal_cache import Principal, PrincipalCache
+
+
+def make_principal(version: int) -> Principal:
+    return Principal(1, "cache@example.com", None, True, None, version)
+
+
+def test_entries_expire_after_ttl():
+    # 他のワーカーでの更新はこのプロセスでは破棄されないので、ttlで切れるのを待つしかない
+    cache = PrincipalCache(enabled=True, ttl=0.0)
+    cache.put(make_principal(1), cache.generation)
+    assert cache.get("cache@example.com") is None
+
+
+def test_invalidate_skips_puts_read_before_it():
+    cache = PrincipalCache(enabled=True, ttl=60)
+    generation = cache.generation
+    cache.invalidate("cache@example.com")
+    cache.put(make_principal(1), generation)
+    assert cache.get("cache@example.com") is None
+    cache.put(make_principal(2), cache.generation)
+    assert cache.get("cache@example.com").version == 2
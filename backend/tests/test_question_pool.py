@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+
+from services.question_pool import QuestionPool
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_pool_only_serves_started_keys(fake_llm):
+    pool = QuestionPool(depth=2, low_water=1)
+    pool.start(num_questions=5)
+    await asyncio.gather(*pool._refills.values())
+    started_calls = len(fake_llm)
+
+    assert pool.take(0, 5) is not None
+    # クライアントが任意に指定した全質問数ではプールを作らず、LLMも呼ばない
+    for num_questions in range(6, 14):
+        assert pool.take(0, num_questions) is None
+    await asyncio.sleep(0)
+    assert set(pool._items) == {(i, 5) for i in range(5)}
+    assert set(pool._refills) == {(i, 5) for i in range(5)}
+    assert len(fake_llm) == started_calls
+    pool.close()
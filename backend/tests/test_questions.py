@@ -0,0 +1,181 @@
+import json
+
+import pytest
+from fastapi import WebSocketDisconnect
+from sqlalchemy import insert
+
+from database import AsyncSessionLocal
+from models import User
+from routes.question_routes import question_controller
+from services.admission import AdmissionRejected
+from tests.conftest import auth_headers
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_user(email: str) -> dict:
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [{"email": email, "hashed_password": "x"}])
+        await db.commit()
+    return auth_headers(email)
+
+
+def parse_sse(text: str) -> list:
+    """SSEの本文を (イベント名, データ) のリストにする"""
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+async def test_stream_releases_admission_slot(client, fake_llm):
+    headers = await create_user("stream@example.com")
+
+    response = await client.post("/api/questions/stream", json={}, headers=headers)
+    assert response.status_code == 200
+    events = parse_sse(response.text)
+    # フォールバックではなく、ストリーミングで生成したチャンクがそのまま届く
+    assert [data["text"] for event, data in events if event == "chunk"] == ["毎日決まった時間に", "運動をしていますか？"]
+    assert events[-1] == ("done", {"question": "毎日決まった時間に運動をしていますか？", "current_num": 1, "total_questions": 5})
+    assert question_controller.admission.active == 0
+
+    await client.post("/api/questions/answer", json={"answer": "はい", "current_num": 0}, headers=headers)
+    response = await client.post("/api/questions/proposal/stream", json={}, headers=headers)
+    assert response.status_code == 200
+    events = parse_sse(response.text)
+    assert len([event for event, _ in events if event == "chunk"]) == 2
+    assert events[-1] == ("done", {"proposal": "毎日10分の読書から始めましょう。応援しています！"})
+    assert question_controller.admission.active == 0
+
+
+async def test_batch_failure_falls_back_without_retrying(client, fake_llm):
+    headers = await create_user("batch@example.com")
+
+    # fake_llmはJSONを返さないので一括生成は失敗する
+    for current_num in range(5):
+        response = await client.post(
+            "/api/questions/",
+            json={"current_num": current_num, "num_questions": 5, "mode": "batch"},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        assert response.json()["question"]
+        if current_num < 4:
+            await client.post(
+                "/api/questions/answer", json={"answer": "はい", "current_num": current_num}, headers=headers
+            )
+
+    batch_calls = [prompt for prompt in fake_llm if "1問目" in prompt]
+    assert len(batch_calls) == 1
+
+
+async def test_proposal_job_from_another_worker(client, fake_llm):
+    headers = await create_user("jobs@example.com")
+    await client.post("/api/questions/", json={}, headers=headers)
+    await client.post("/api/questions/answer", json={"answer": "はい", "current_num": 0}, headers=headers)
+
+    response = await client.post("/api/questions/proposal/jobs", json={}, headers=headers)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    response = await client.get(f"/api/questions/proposal/jobs/{job_id}?wait=5", headers=headers)
+    assert response.json()["status"] == "done"
+
+    # 別のワーカープロセスで登録されたジョブは、見つからない場合と区別して返す
+    worker_id, local_id = job_id.split("-", 1)
+    other_worker = "0" * len(worker_id) if worker_id != "0" * len(worker_id) else "1" * len(worker_id)
+    response = await client.get(f"/api/questions/proposal/jobs/{other_worker}-{local_id}", headers=headers)
+    assert response.status_code == 421
+    # 存在しない、期限切れ、形式が正しくないIDは404
+    for missing in (f"{worker_id}-{'0' * 32}", "missing", f"{other_worker}-missing"):
+        response = await client.get(f"/api/questions/proposal/jobs/{missing}", headers=headers)
+        assert response.status_code == 404
+
+
+class FakeWebSocket:
+    """受信するメッセージを順に返し、送信したメッセージを記録する"""
+
+    def __init__(self, messages: list, headers: dict):
+        self.incoming = [json.dumps(message) for message in messages]
+        self.sent = []
+        self.headers = headers
+
+    async def accept(self):
+        pass
+
+    async def close(self, code: int, reason: str = ""):
+        self.sent.append({"type": "close", "code": code})
+
+    async def receive_text(self) -> str:
+        if not self.incoming:
+            raise WebSocketDisconnect()
+        return self.incoming.pop(0)
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+
+async def test_websocket_next_retries_after_rejected_question(client, fake_llm, monkeypatch):
+    headers = await create_user("ws@example.com")
+    acquire = question_controller.admission.acquire
+    calls = []
+
+    async def reject_second():
+        calls.append(True)
+        if len(calls) == 2:
+            raise AdmissionRejected(retry_after=3)
+        await acquire()
+
+    monkeypatch.setattr(question_controller.admission, "acquire", reject_second)
+    websocket = FakeWebSocket(
+        [{"type": "start", "num_questions": 2}, {"type": "answer", "answer": "はい"}, {"type": "next"}, {"type": "next"}],
+        {"authorization": headers["Authorization"]},
+    )
+    await question_controller.quiz_websocket(websocket)
+
+    started, rejected, retried, repeated = websocket.sent
+    assert started["type"] == "question" and started["current_num"] == 1
+    # 回答は保存されたが、次の質問の生成は混雑で断られる
+    assert rejected == {"type": "error", "status": 429, "detail": rejected["detail"], "retry_after": 3}
+    assert retried["type"] == "question" and retried["current_num"] == 2
+    # 生成済みの質問は作り直さずに返す
+    assert repeated == retried
+    assert len(calls) == 3
+
+
+class FakePool:
+    question = "事前生成した質問です。毎日運動をしていますか？"
+
+    def take(self, current_num, num_questions):
+        return self.question
+
+
+async def test_quota_is_charged_only_for_llm_calls(client, fake_llm, monkeypatch):
+    headers = await create_user("quota@example.com")
+    quota = question_controller.question_quota
+    user_id = (await client.get("/api/auth/me", headers=headers)).json()["id"]
+    acquire = question_controller.admission.acquire
+
+    # 混雑で断られた分は消費しない
+    async def reject():
+        raise AdmissionRejected(retry_after=1)
+
+    monkeypatch.setattr(question_controller.admission, "acquire", reject)
+    response = await client.post("/api/questions/", json={}, headers=headers)
+    assert response.status_code == 429
+    assert quota._bucket(user_id).tokens == quota.burst
+    monkeypatch.setattr(question_controller.admission, "acquire", acquire)
+
+    # 事前生成済みの質問を返した分も消費しない
+    monkeypatch.setattr(question_controller.question_service, "pool", FakePool())
+    response = await client.post("/api/questions/", json={}, headers=headers)
+    assert response.json()["question"] == FakePool.question
+    assert quota._bucket(user_id).tokens == quota.burst
+    assert fake_llm == []
+
+    # LLMを呼び出したら1回分消費する
+    monkeypatch.setattr(question_controller.question_service, "pool", None)
+    response = await client.post("/api/questions/", json={}, headers=headers)
+    assert response.status_code == 200
+    assert len(fake_llm) == 1
+    assert quota.burst - 1 <= quota._bucket(user_id).tokens < quota.burst - 0.5
@@ -0,0 +1,45 @@
+import pytest
+
+from services.session_store import MemorySessionStore, SQLiteSessionStore, SessionConflict
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_memory_store_reports_lru_eviction_separately():
+    reasons = []
+    store = MemorySessionStore(ttl=3600, max_entries=1, on_expire=lambda session, reason: reasons.append(reason))
+    await store.load(1)
+    await store.load(2)
+    assert reasons == ["evicted"]
+
+    store.ttl = 0.0
+    await store.load(3)
+    assert reasons == ["evicted", "expired"]
+
+
+async def test_sqlite_store_rejects_stale_save_from_another_worker(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = SQLiteSessionStore(path=path), SQLiteSessionStore(path=path)
+    try:
+        session = await first.load(1)
+        session.questions.append("毎日運動をしていますか？")
+        await first.save(session)
+
+        # 2つのワーカーが同じバージョンを読み、先に保存した方だけが通る
+        mine, theirs = await first.load(1), await second.load(1)
+        theirs.answers.append("はい")
+        await second.save(theirs)
+        mine.answers.append("いいえ")
+        with pytest.raises(SessionConflict):
+            await first.save(mine)
+        assert first.conflicts == 1
+
+        # 読み直せば他のワーカーの更新が見え、保存できる
+        reloaded = await first.load(1)
+        assert reloaded.answers == ["はい"]
+        reloaded.questions.append("読書は好きですか？")
+        await first.save(reloaded)
+        assert (await second.load(1)).questions == ["毎日運動をしていますか？", "読書は好きですか？"]
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+from services.session_store import QuizSession
+from services.transcript_service import TranscriptWriter
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_flush_keeps_batch_when_cancelled(monkeypatch):
+    writer = TranscriptWriter(enabled=True, batch_size=10)
+    for user_id in range(3):
+        writer.record(QuizSession(user_id, questions=["質問です。答えてください"]), "reset")
+    writing = asyncio.Event()
+
+    async def slow_write(batch):
+        writing.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(writer, "_write", slow_write)
+    task = asyncio.create_task(writer.flush())
+    await writing.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # 書き出し中にキャンセルされたバッチは失われずに先頭に戻る
+    assert [transcript.user_id for transcript in writer._buffer] == [0, 1, 2]
+    assert writer.written == 0 and writer.dropped == 0
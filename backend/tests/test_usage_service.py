@@ -0,0 +1,19 @@
+import pytest
+
+from services.usage_service import QuotaLimiter, UsageMeter
+
+pytestmark = pytest.mark.anyio
+
+
+def test_usage_meter_rejects_unsupported_database():
+    with pytest.raises(ValueError):
+        UsageMeter(dialect="mysql")
+    UsageMeter(dialect="postgresql")
+
+
+def test_quota_is_checked_without_consuming():
+    quota = QuotaLimiter(per_minute=0, burst=1)
+    assert quota.retry_after(1) == 0
+    assert quota.retry_after(1) == 0
+    quota.consume(1)
+    assert quota.retry_after(1) > 0
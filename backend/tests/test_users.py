@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from sqlalchemy import insert
+
+from database import AsyncSessionLocal
+from models import User
+from tests.conftest import auth_headers
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_users(*emails: str) -> dict:
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), [{"email": email, "hashed_password": "x"} for email in emails])
+        await db.commit()
+    return auth_headers(emails[0])
+
+
+async def test_listing_pages_by_id_cursor_and_matches_export(client):
+    emails = [f"page{i}@example.com" for i in range(5)]
+    headers = await create_users(*emails)
+
+    pages, after = [], None
+    while True:
+        params = {"limit": 2} if after is None else {"limit": 2, "after": after}
+        response = await client.get("/api/users/", params=params, headers=headers)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= 2
+        pages.append(page)
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+        # カーソルはページの最後のID
+        assert int(after) == page[-1]["id"]
+
+    listed = [user for page in pages for user in page]
+    ids = [user["id"] for user in listed]
+    assert ids == sorted(set(ids))
+    assert set(emails) <= {user["email"] for user in listed}
+
+    response = await client.get("/api/users/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [user["id"] for user in exported] == ids
+    assert all("hashed_password" not in user for user in exported)
+
+
+async def test_bulk_operations_report_per_row_errors(client, fake_hasher):
+    headers = await create_users("bulk-admin@example.com", "bulk-taken@example.com")
+
+    response = await client.post("/api/users/bulk/import", headers=headers, json=[
+        {"email": "bulk-a@example.com", "password": "secret"},
+        {"email": "bulk-taken@example.com", "password": "secret"},
+        {"email": "bulk-a@example.com", "password": "secret"},
+        {"email": "bulk-b@example.com"},
+        {"email": "bulk-b@example.com", "password": "secret", "full_name": "B"},
+    ])
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["succeeded"], result["failed"]) == (2, 3)
+    assert [error["index"] for error in result["errors"]] == [1, 2, 3]
+
+    # NDJSONでは読めない行だけがエラーになる
+    response = await client.post(
+        "/api/users/bulk/import",
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+        content='{"email": "bulk-c@example.com", "password": "secret"}\n{broken\n',
+    )
+    assert response.json()["succeeded"] == 1
+    assert [error["index"] for error in response.json()["errors"]] == [1]
+
+    users = {user["email"]: user["id"] for user in (await client.get("/api/users/", headers=headers)).json()}
+    a, b, c = users["bulk-a@example.com"], users["bulk-b@example.com"], users["bulk-c@example.com"]
+
+    response = await client.post("/api/users/bulk/update", headers=headers, json=[
+        {"id": a, "full_name": "A"},
+        {"id": 999999, "full_name": "存在しない"},
+        {"id": a, "full_name": "二回目"},
+        {"id": b, "email": "bulk-taken@example.com"},
+    ])
+    result = response.json()
+    assert (result["succeeded"], result["failed"]) == (1, 3)
+    assert [error["index"] for error in result["errors"]] == [1, 2, 3]
+    assert (await client.get(f"/api/users/{a}", headers=headers)).json()["full_name"] == "A"
+    assert (await client.get(f"/api/users/{b}", headers=headers)).json()["email"] == "bulk-b@example.com"
+
+    response = await client.post("/api/users/bulk/deactivate", headers=headers, json=[{"id": c}, {"id": 999999}])
+    result = response.json()
+    assert (result["succeeded"], result["failed"]) == (1, 1)
+    assert result["errors"][0]["index"] == 1
+    assert (await client.get(f"/api/users/{c}", headers=headers)).json()["is_active"] is False